@@ -1,19 +1,48 @@
 from flask import Flask, render_template, jsonify, abort, url_for
 from dotenv import load_dotenv
+from markupsafe import Markup
+import click
 import random
+import math
+import bisect
+import csv
+import mmap
+import struct
+import sys
 import json
+import gzip
 import os
+import re
+import functools
+import mimetypes
+import zlib
+import atexit
 import hashlib
 import time
 import threading
 import ipaddress
-import re
 import sqlite3
 import secrets
+import heapq
+import http.client
+import queue
 import urllib.parse
-import urllib.request
+from array import array
+from collections import OrderedDict
 from contextlib import contextmanager
-from datetime import datetime
+from datetime import datetime, timedelta
+from types import MappingProxyType
+
+from ua_classifier import classifier_stats, classify_user_agent
+from static_assets import (
+    PRECOMPRESSED_ENCODINGS,
+    WEBP_METHOD,
+    StaticAssetManifest,
+    is_runtime_file,
+    load_image,
+    resize_to_width,
+    save_webp,
+)
 
 # Load environment variables from .env file
 load_dotenv()
@@ -31,32 +60,128 @@ SHOW_RESUME = False
 _data_dir = os.getenv('DATA_DIR', os.path.join('static', 'data'))
 _visits_file = os.path.join(_data_dir, 'visits.json')         # legacy mirror
 _visitor_db_file = os.path.join(_data_dir, 'visitors.sqlite3')
-_visit_lock = threading.Lock()
-
-_BOT_UA_RE = re.compile(
-    r'(bot|crawl|spider|slurp|facebookexternalhit|preview|scanner|uptime|monitor|headless)',
-    re.IGNORECASE,
-)
-
 
 def _utc_iso():
     return datetime.utcnow().replace(microsecond=0).isoformat() + 'Z'
 
 
+class _SQLitePool:
+    """Small thread-safe pool of long-lived SQLite connections.
+
+    PRAGMAs run once per connection and each connection keeps its own prepared
+    statement cache, so a checkout costs a list pop instead of a connect. The
+    pool remembers which process created it and starts over after a fork,
+    since SQLite handles must never be shared across processes.
+    """
+
+    def __init__(self, path, max_idle=4, cached_statements=128):
+        self.path = path
+        self.max_idle = max(max_idle, 1)
+        self.cached_statements = cached_statements
+        self._lock = threading.Lock()
+        self._idle = []
+        self._orphans = []
+        self._pid = os.getpid()
+        self._dir_ready = False
+        self._stats = {'created': 0, 'reused': 0, 'discarded': 0, 'fork_resets': 0, 'in_use': 0}
+
+    def _connect(self):
+        if not self._dir_ready:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            self._dir_ready = True
+        conn = sqlite3.connect(
+            self.path,
+            timeout=10,
+            check_same_thread=False,
+            cached_statements=self.cached_statements,
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA busy_timeout = 10000')
+        try:
+            conn.execute('PRAGMA journal_mode = WAL')
+        except sqlite3.DatabaseError:
+            pass
+        return conn
+
+    def _check_fork(self):
+        # Caller holds self._lock.
+        pid = os.getpid()
+        if pid != self._pid:
+            # Closing the parent's handles from the child is unsafe; keep them
+            # referenced so they are never finalized here.
+            self._orphans.extend(self._idle)
+            self._idle = []
+            self._pid = pid
+            self._stats['in_use'] = 0
+            self._stats['fork_resets'] += 1
+
+    def _acquire(self):
+        with self._lock:
+            self._check_fork()
+            conn = self._idle.pop() if self._idle else None
+            self._stats['in_use'] += 1
+            self._stats['reused' if conn is not None else 'created'] += 1
+        if conn is None:
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._lock:
+                    self._stats['in_use'] -= 1
+                raise
+        return conn
+
+    def _release(self, conn, pid):
+        healthy = True
+        if conn.in_transaction:
+            try:
+                conn.rollback()
+            except sqlite3.Error:
+                healthy = False
+        with self._lock:
+            if pid != self._pid:
+                self._orphans.append(conn)
+                return
+            self._stats['in_use'] -= 1
+            if healthy and len(self._idle) < self.max_idle:
+                self._idle.append(conn)
+                return
+            self._stats['discarded'] += 1
+        conn.close()
+
+    @contextmanager
+    def connection(self):
+        conn = self._acquire()
+        pid = self._pid
+        try:
+            yield conn
+        finally:
+            self._release(conn, pid)
+
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+            same_process = self._pid == os.getpid()
+        if same_process:
+            for conn in idle:
+                conn.close()
+
+    def stats(self):
+        with self._lock:
+            self._check_fork()
+            return dict(self._stats, idle=len(self._idle), max_idle=self.max_idle)
+
+
+_visitor_pool = _SQLitePool(
+    _visitor_db_file,
+    max_idle=int(os.getenv('VISITOR_DB_POOL_SIZE', '4')),
+)
+atexit.register(_visitor_pool.close_all)
+
+
 @contextmanager
 def _visitor_db():
-    os.makedirs(_data_dir, exist_ok=True)
-    conn = sqlite3.connect(_visitor_db_file, timeout=10)
-    conn.row_factory = sqlite3.Row
-    conn.execute('PRAGMA busy_timeout = 10000')
-    try:
-        conn.execute('PRAGMA journal_mode = WAL')
-    except sqlite3.DatabaseError:
-        pass
-    try:
+    with _visitor_pool.connection() as conn:
         yield conn
-    finally:
-        conn.close()
 
 
 def _legacy_visit_count():
@@ -67,7 +192,11 @@ def _legacy_visit_count():
         return 0
 
 
-def _write_visit_count_mirror(count):
+def _write_visit_count_mirror(count, reset=False):
+    # Written after the commit, so a worker that committed earlier may get
+    # here later; only a reset may move the mirror backwards.
+    if not reset and _legacy_visit_count() > count:
+        return
     try:
         os.makedirs(_data_dir, exist_ok=True)
         tmp_path = _visits_file + '.tmp'
@@ -78,53 +207,308 @@ def _write_visit_count_mirror(count):
         pass
 
 
-def _ensure_visitor_db():
+# Schema changes are ordered steps keyed on PRAGMA user_version. Each step runs
+# exactly once per database, inside the same transaction that bumps the version,
+# so request handlers never issue DDL. Append new steps; never edit shipped ones.
+def _migration_0001_initial(conn):
+    # IF NOT EXISTS keeps this safe for databases created before versioning.
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS visitor_counter (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            count INTEGER NOT NULL DEFAULT 0,
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS visitor_events (
+            id TEXT PRIMARY KEY,
+            sequence INTEGER NOT NULL,
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL,
+            path TEXT,
+            referrer_host TEXT,
+            user_agent_family TEXT,
+            country TEXT,
+            region TEXT,
+            city TEXT,
+            lat REAL,
+            lon REAL,
+            geocode_status TEXT NOT NULL DEFAULT 'pending'
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_visitor_events_created ON visitor_events(created_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_visitor_events_geo ON visitor_events(lat, lon)")
+    row = conn.execute("SELECT count FROM visitor_counter WHERE id = 1").fetchone()
+    if not row:
+        now = _utc_iso()
+        conn.execute(
+            "INSERT INTO visitor_counter (id, count, created_at, updated_at) VALUES (1, ?, ?, ?)",
+            (_legacy_visit_count(), now, now),
+        )
+
+
+def _migration_0002_unique_sequence(conn):
+    # Sequences come from the counter under SQLite's write lock; the unique
+    # index turns any future violation into a failed insert instead of a
+    # silently duplicated visit number. Databases written before this step
+    # may already hold duplicates from the old read-modify-write counter,
+    # which counted each colliding pair once; keep the first row of each.
+    conn.execute("""
+        DELETE FROM visitor_events
+         WHERE rowid NOT IN (SELECT MIN(rowid) FROM visitor_events GROUP BY sequence)
+    """)
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_visitor_events_sequence ON visitor_events(sequence)")
+
+
+def _migration_0003_geocode_jobs(conn):
+    # Durable geocoding queue. The raw IP lives here only until its lookup
+    # finishes (or gives up); the row is deleted together with the event update.
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS geocode_jobs (
+            event_id TEXT PRIMARY KEY,
+            ip TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL DEFAULT 0,
+            lease_until REAL NOT NULL DEFAULT 0,
+            created_at TEXT NOT NULL
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_geocode_jobs_due ON geocode_jobs(lease_until, next_attempt_at)")
+
+
+def _migration_0004_geo_cache(conn):
+    # Keys are salted hashes of a /24 or /48 prefix, never raw addresses.
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS geo_cache (
+            key TEXT PRIMARY KEY,
+            payload TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_geo_cache_expires ON geo_cache(expires_at)")
+
+
+def _migration_0005_location_rollup(conn):
+    # One row per distinct mapped location, kept in step with visitor_events by
+    # the same transactions that geocode them. Backfilled from existing events.
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS visitor_location_rollup (
+            lat REAL NOT NULL,
+            lon REAL NOT NULL,
+            city TEXT NOT NULL DEFAULT '',
+            country TEXT NOT NULL DEFAULT '',
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (lat, lon, city, country)
+        )
+    """)
+    conn.execute("DELETE FROM visitor_location_rollup")
+    conn.execute("""
+        INSERT INTO visitor_location_rollup (lat, lon, city, country, count)
+        SELECT lat, lon, COALESCE(city, ''), COALESCE(country, ''), COUNT(*)
+          FROM visitor_events
+         WHERE lat IS NOT NULL AND lon IS NOT NULL
+         GROUP BY lat, lon, COALESCE(city, ''), COALESCE(country, '')
+    """)
+
+
+def _migration_0006_rollup_quadkey(conn):
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(visitor_location_rollup)")}
+    if 'quadkey' not in columns:
+        conn.execute("ALTER TABLE visitor_location_rollup ADD COLUMN quadkey TEXT NOT NULL DEFAULT ''")
+    rows = conn.execute("SELECT rowid, lat, lon FROM visitor_location_rollup").fetchall()
+    conn.executemany(
+        "UPDATE visitor_location_rollup SET quadkey = ? WHERE rowid = ?",
+        [(_quadkey(row[1], row[2]), row[0]) for row in rows],
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_location_rollup_geo ON visitor_location_rollup(lat, lon)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_location_rollup_quadkey ON visitor_location_rollup(quadkey)")
+
+
+def _migration_0007_locations_version(conn):
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(visitor_counter)")}
+    if 'locations_version' not in columns:
+        conn.execute("ALTER TABLE visitor_counter ADD COLUMN locations_version INTEGER NOT NULL DEFAULT 0")
+
+
+def _migration_0008_visitor_stats(conn):
+    # Hour/day aggregates per dimension, filled incrementally from visitor_events
+    # past a sequence watermark. dimension 'total' (value '') counts all visits.
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS visitor_stats_rollup (
+            granularity TEXT NOT NULL,
+            dimension TEXT NOT NULL,
+            bucket TEXT NOT NULL,
+            value TEXT NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (granularity, dimension, bucket, value)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS visitor_stats_state (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            watermark INTEGER NOT NULL DEFAULT 0,
+            updated_at TEXT NOT NULL
+        )
+    """)
+    conn.execute(
+        "INSERT OR IGNORE INTO visitor_stats_state (id, watermark, updated_at) VALUES (1, 0, ?)",
+        (_utc_iso(),),
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_visitor_events_pending ON visitor_events(sequence) "
+        "WHERE geocode_status = 'pending'"
+    )
+
+
+def _migration_0009_geo_cache_salt(conn):
+    # Random salt for geo_cache keys on deploys without GEO_CACHE_SALT or a
+    # real SECRET_KEY. Generated once and shared by every worker; a known salt
+    # would let all 2^24 IPv4 /24 keys be reversed by brute force.
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS visitor_secrets (
+            name TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        )
+    """)
+    conn.execute(
+        "INSERT OR IGNORE INTO visitor_secrets (name, value) VALUES ('geo_cache_salt', ?)",
+        (secrets.token_hex(32),),
+    )
+
+
+VISITOR_DB_MIGRATIONS = (
+    (1, 'visitor_counter + visitor_events', _migration_0001_initial),
+    (2, 'unique visitor_events.sequence', _migration_0002_unique_sequence),
+    (3, 'geocode_jobs queue', _migration_0003_geocode_jobs),
+    (4, 'geo_cache', _migration_0004_geo_cache),
+    (5, 'visitor_location_rollup', _migration_0005_location_rollup),
+    (6, 'visitor_location_rollup.quadkey', _migration_0006_rollup_quadkey),
+    (7, 'visitor_counter.locations_version', _migration_0007_locations_version),
+    (8, 'visitor_stats_rollup', _migration_0008_visitor_stats),
+    (9, 'visitor_secrets.geo_cache_salt', _migration_0009_geo_cache_salt),
+)
+
+
+def migrate_visitor_db():
+    """Apply pending visitor DB migrations. Returns (from_version, to_version)."""
     with _visitor_db() as conn:
-        conn.execute("""
-            CREATE TABLE IF NOT EXISTS visitor_counter (
-                id INTEGER PRIMARY KEY CHECK (id = 1),
-                count INTEGER NOT NULL DEFAULT 0,
-                created_at TEXT NOT NULL,
-                updated_at TEXT NOT NULL
-            )
-        """)
-        conn.execute("""
-            CREATE TABLE IF NOT EXISTS visitor_events (
-                id TEXT PRIMARY KEY,
-                sequence INTEGER NOT NULL,
-                created_at TEXT NOT NULL,
-                updated_at TEXT NOT NULL,
-                path TEXT,
-                referrer_host TEXT,
-                user_agent_family TEXT,
-                country TEXT,
-                region TEXT,
-                city TEXT,
-                lat REAL,
-                lon REAL,
-                geocode_status TEXT NOT NULL DEFAULT 'pending'
-            )
-        """)
-        conn.execute("CREATE INDEX IF NOT EXISTS idx_visitor_events_created ON visitor_events(created_at)")
-        conn.execute("CREATE INDEX IF NOT EXISTS idx_visitor_events_geo ON visitor_events(lat, lon)")
-        row = conn.execute("SELECT count FROM visitor_counter WHERE id = 1").fetchone()
-        if not row:
-            now = _utc_iso()
-            conn.execute(
-                "INSERT INTO visitor_counter (id, count, created_at, updated_at) VALUES (1, ?, ?, ?)",
-                (_legacy_visit_count(), now, now),
-            )
-        conn.commit()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            current = int(conn.execute("PRAGMA user_version").fetchone()[0])
+            version = current
+            for step_version, _description, step in VISITOR_DB_MIGRATIONS:
+                if step_version <= version:
+                    continue
+                step(conn)
+                conn.execute(f"PRAGMA user_version = {int(step_version)}")
+                version = step_version
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return current, version
 
 
-def _read_visit_count():
+def _read_visitor_counter_row(conn):
+    """Return (count, locations_version) from the counter row."""
+    row = conn.execute("SELECT count, locations_version FROM visitor_counter WHERE id = 1").fetchone()
+    if not row:
+        return _legacy_visit_count(), 0
+    return int(row['count']), int(row['locations_version'])
+
+
+def _read_visitor_counter_from_db():
     try:
-        _ensure_visitor_db()
         with _visitor_db() as conn:
-            row = conn.execute("SELECT count FROM visitor_counter WHERE id = 1").fetchone()
-            return int(row['count']) if row else _legacy_visit_count()
+            return _read_visitor_counter_row(conn)
     except Exception:
-        return _legacy_visit_count()
+        return _legacy_visit_count(), 0
+
+
+class _VisitCountCache:
+    """Process-local copy of the visit counter.
+
+    Reads inside the ``ttl`` window are served from memory with no SQLite call.
+    Once the window lapses, one thread revalidates with ``PRAGMA data_version``
+    on a dedicated connection; the value only changes when another connection
+    (another thread's pool checkout or another worker) has committed, so the
+    counter row is re-read only when it may actually have moved. Writes in
+    this process push their new count in directly via ``store``.
+
+    ``locations_version`` rides along on the same row; it moves whenever the
+    location rollup changes and serves as the map API's cache validator.
+    """
+
+    def __init__(self, ttl_ms):
+        self.ttl = max(ttl_ms, 0) / 1000.0
+        self.enabled = self.ttl > 0
+        self._lock = threading.Lock()
+        self._value = None
+        self._locations_version = 0
+        self._checked_at = 0.0
+        self._data_version = None
+        self._conn = None
+        self._pid = None
+        self._stats = {'hits': 0, 'revalidations': 0, 'reloads': 0, 'errors': 0}
+
+    def _connection(self):
+        pid = os.getpid()
+        if self._conn is None or self._pid != pid:
+            # A handle inherited across fork is abandoned, never closed.
+            self._conn = _visitor_pool._connect()
+            self._pid = pid
+            self._data_version = None
+        return self._conn
+
+    def snapshot(self):
+        """Return (count, locations_version), from memory when fresh enough."""
+        if not self.enabled:
+            return _read_visitor_counter_from_db()
+        value = self._value
+        if value is not None and time.monotonic() - self._checked_at < self.ttl and self._pid == os.getpid():
+            self._stats['hits'] += 1
+            return value, self._locations_version
+        with self._lock:
+            if self._value is not None and time.monotonic() - self._checked_at < self.ttl and self._pid == os.getpid():
+                self._stats['hits'] += 1
+                return self._value, self._locations_version
+            try:
+                conn = self._connection()
+                self._stats['revalidations'] += 1
+                version = conn.execute('PRAGMA data_version').fetchone()[0]
+                if self._value is None or version != self._data_version:
+                    self._value, self._locations_version = _read_visitor_counter_row(conn)
+                    self._data_version = version
+                    self._stats['reloads'] += 1
+                self._checked_at = time.monotonic()
+                return self._value, self._locations_version
+            except Exception:
+                self._stats['errors'] += 1
+                self._conn = None
+                return _read_visitor_counter_from_db()
+
+    def get(self):
+        return self.snapshot()[0]
+
+    def store(self, count, reset=False):
+        """Record a count this process just committed."""
+        if not self.enabled:
+            return
+        with self._lock:
+            if reset or self._value is None or count > self._value:
+                self._value = count
+                self._checked_at = time.monotonic()
+
+    def stats(self):
+        return dict(self._stats, enabled=self.enabled, ttl_ms=int(self.ttl * 1000), value=self._value)
+
+
+_visit_count_cache = _VisitCountCache(int(os.getenv('VISIT_COUNT_CACHE_MS', '1000')))
+
+
+def _read_visit_count():
+    return _visit_count_cache.get()
 
 
 def get_real_ip():
@@ -145,27 +529,12 @@ def is_private_ip(ip):
 
 def _is_likely_bot():
     from flask import request
-    ua = request.headers.get('User-Agent', '')
-    return bool(_BOT_UA_RE.search(ua))
+    return classify_user_agent(request.headers.get('User-Agent', ''))[0]
 
 
 def _ua_family():
     from flask import request
-    ua = request.headers.get('User-Agent', '')
-    if not ua:
-        return 'unknown'
-    checks = (
-        ('mobile_safari', 'Mobile', 'Safari'),
-        ('ios_webview', 'iPhone', 'AppleWebKit'),
-        ('chrome', 'Chrome'),
-        ('firefox', 'Firefox'),
-        ('safari', 'Safari'),
-        ('edge', 'Edg/'),
-    )
-    for label, *needles in checks:
-        if all(n in ua for n in needles):
-            return label
-    return 'browser'
+    return classify_user_agent(request.headers.get('User-Agent', ''))[1]
 
 
 def _visit_path_from_request():
@@ -191,20 +560,54 @@ def _referrer_host():
     return host[:120] if host else ''
 
 
-def _geocode_ip(ip):
-    if not ip or is_private_ip(ip):
-        return {'geocode_status': 'local_or_private'}
+_IPINFO_BASE_URL = os.getenv('IPINFO_BASE_URL', 'https://ipinfo.io').rstrip('/')
+_ipinfo_local = threading.local()
+
+
+def _ipinfo_get(path):
+    """GET ``path`` from ipinfo on this thread's keep-alive connection.
+
+    Returns ``(status, body_bytes)``. A connection the server has already
+    closed is retried once on a fresh socket; any other failure raises.
+    """
+    parts = urllib.parse.urlsplit(_IPINFO_BASE_URL)
+    headers = {'User-Agent': 'hunter-visitor-map/1.0', 'Connection': 'keep-alive'}
+    for attempt in range(2):
+        conn = getattr(_ipinfo_local, 'conn', None)
+        if conn is None:
+            conn_cls = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+            conn = conn_cls(parts.netloc, timeout=4)
+            _ipinfo_local.conn = conn
+        try:
+            conn.request('GET', parts.path + path, headers=headers)
+            resp = conn.getresponse()
+            body = resp.read()
+            if resp.will_close:
+                conn.close()
+                _ipinfo_local.conn = None
+            return resp.status, body
+        except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+            conn.close()
+            _ipinfo_local.conn = None
+            if attempt:
+                raise
+        except Exception:
+            conn.close()
+            _ipinfo_local.conn = None
+            raise
+
+
+def _geocode_ip_remote(ip):
     token = os.getenv('IPINFO_TOKEN', '').strip()
     quoted_ip = urllib.parse.quote(ip, safe='')
-    url = f'https://ipinfo.io/{quoted_ip}/json'
+    path = f'/{quoted_ip}/json'
     if token:
-        url += f'?token={urllib.parse.quote(token)}'
-    req = urllib.request.Request(url, headers={'User-Agent': 'hunter-visitor-map/1.0'})
+        path += f'?token={urllib.parse.quote(token)}'
     try:
-        with urllib.request.urlopen(req, timeout=4) as resp:
-            if getattr(resp, 'status', 200) != 200:
-                return {'geocode_status': f'http_{getattr(resp, "status", "error")}'}
-            data = json.loads(resp.read().decode('utf-8'))
+        status, body = _ipinfo_get(path)
+        if status != 200:
+            return {'geocode_status': f'http_{status}'}
+        data = json.loads(body.decode('utf-8'))
     except Exception:
         return {'geocode_status': 'lookup_failed'}
 
@@ -228,36 +631,930 @@ def _geocode_ip(ip):
     }
 
 
-def _update_visitor_event_location(event_id, ip):
-    geo = _geocode_ip(ip)
+# ============================================
+# OFFLINE IP-RANGE GEOLOCATION
+# GEOCODE_BACKEND=offline resolves visitors from a local range file before
+# falling back to ipinfo. GEO_RANGES_FILE may be a CSV of
+# start,end,lat,lon,city,country rows (parsed into arrays at startup) or the
+# compact binary built by `flask build-geo-index`, which is memory-mapped so
+# every gunicorn worker shares the same page-cache pages.
+# ============================================
+_GEO_INDEX_MAGIC = b'HXGEO01\0'
+_GEO_INDEX_HEADER = struct.Struct('<8sIIII')   # magic, v4 rows, v6 rows, locations, locations json bytes
+
+
+class _FixedWidthKeys:
+    """Read-only sequence of big-endian address keys for ``bisect``.
+
+    Fixed-width big-endian bytes sort exactly like the integers they encode,
+    so the same search works for 4-byte IPv4 and 16-byte IPv6 keys, whether
+    the buffer is a bytes object or a slice of an mmap.
+    """
+
+    __slots__ = ('buf', 'width', 'count')
+
+    def __init__(self, buf, width):
+        self.buf = buf
+        self.width = width
+        self.count = len(buf) // width
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        start = index * self.width
+        return bytes(self.buf[start:start + self.width])
+
+
+class _RangeColumns:
+    """Sorted, non-overlapping ranges for one address family, column-wise."""
+
+    __slots__ = ('starts', 'ends', 'lat', 'lon', 'loc')
+
+    def __init__(self, starts, ends, lat, lon, loc):
+        self.starts = starts
+        self.ends = ends
+        self.lat = lat
+        self.lon = lon
+        self.loc = loc
+
+    def find(self, key):
+        index = bisect.bisect_right(self.starts, key) - 1
+        if index < 0 or self.ends[index] < key:
+            return None
+        return index
+
+
+class OfflineGeoIndex:
+    """Microsecond IP -> city lookups from a local range dataset."""
+
+    def __init__(self, v4, v6, locations, source=''):
+        self._families = {4: v4, 6: v6}
+        self.locations = locations
+        self.source = source
+        self._mmap = None
+        self._stats = {'hits': 0, 'misses': 0}
+
+    def __len__(self):
+        return len(self._families[4].starts) + len(self._families[6].starts)
+
+    @staticmethod
+    def _parse_rows(rows):
+        """Yield (version, start_bytes, end_bytes, lat, lon, city, country), skipping junk rows."""
+        for row in rows:
+            if len(row) < 6:
+                continue
+            try:
+                start = ipaddress.ip_address(row[0].strip())
+                end = ipaddress.ip_address(row[1].strip())
+                lat = float(row[2])
+                lon = float(row[3])
+            except ValueError:
+                continue   # header line or malformed row
+            if start.version != end.version or int(end) < int(start):
+                continue
+            yield start.version, start.packed, end.packed, lat, lon, row[4].strip()[:120], row[5].strip()[:12]
+
+    @classmethod
+    def from_csv(cls, path):
+        by_family = {4: [], 6: []}
+        with open(path, 'r', newline='', encoding='utf-8') as f:
+            for version, *rest in cls._parse_rows(csv.reader(f)):
+                by_family[version].append(rest)
+
+        locations = []
+        location_ids = {}
+        columns = {}
+        for version, rows in by_family.items():
+            rows.sort(key=lambda r: r[0])
+            starts, ends = bytearray(), bytearray()
+            lat, lon, loc = array('f'), array('f'), array('I')
+            last_end = None
+            for start, end, row_lat, row_lon, city, country in rows:
+                if last_end is not None and start <= last_end:
+                    continue   # overlapping range; first one wins
+                last_end = end
+                key = (city, country)
+                if key not in location_ids:
+                    location_ids[key] = len(locations)
+                    locations.append(key)
+                starts += start
+                ends += end
+                lat.append(row_lat)
+                lon.append(row_lon)
+                loc.append(location_ids[key])
+            width = 4 if version == 4 else 16
+            columns[version] = _RangeColumns(
+                _FixedWidthKeys(bytes(starts), width),
+                _FixedWidthKeys(bytes(ends), width),
+                lat, lon, loc,
+            )
+        return cls(columns[4], columns[6], locations, source=path)
+
+    def save(self, path):
+        """Write the compact little-endian binary format read by ``open``."""
+        locations_json = json.dumps(self.locations, separators=(',', ':')).encode('utf-8')
+        v4, v6 = self._families[4], self._families[6]
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(_GEO_INDEX_HEADER.pack(
+                _GEO_INDEX_MAGIC, len(v4.starts), len(v6.starts), len(self.locations), len(locations_json)
+            ))
+            for columns in (v4, v6):
+                f.write(bytes(columns.starts.buf))
+                f.write(bytes(columns.ends.buf))
+                for values in (columns.lat, columns.lon, columns.loc):
+                    values = array(values.typecode, values)
+                    if sys.byteorder != 'little':
+                        values.byteswap()
+                    f.write(values.tobytes())
+            f.write(locations_json)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def open(cls, path):
+        """Memory-map a binary index built by ``save``."""
+        with open(path, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, v4_count, v6_count, _loc_count, loc_len = _GEO_INDEX_HEADER.unpack_from(mm, 0)
+        if magic != _GEO_INDEX_MAGIC:
+            mm.close()
+            raise ValueError(f'{path} is not a geo range index')
+        view = memoryview(mm)
+        offset = _GEO_INDEX_HEADER.size
+        families = []
+        for count, width in ((v4_count, 4), (v6_count, 16)):
+            starts = _FixedWidthKeys(view[offset:offset + count * width], width)
+            offset += count * width
+            ends = _FixedWidthKeys(view[offset:offset + count * width], width)
+            offset += count * width
+            numeric = []
+            for typecode in ('f', 'f', 'I'):
+                chunk = view[offset:offset + count * 4]
+                offset += count * 4
+                if sys.byteorder == 'little':
+                    numeric.append(chunk.cast(typecode))
+                else:
+                    values = array(typecode, chunk.tobytes())
+                    values.byteswap()
+                    numeric.append(values)
+            families.append(_RangeColumns(starts, ends, *numeric))
+        locations = [tuple(loc) for loc in json.loads(bytes(view[offset:offset + loc_len]).decode('utf-8'))]
+        index = cls(families[0], families[1], locations, source=path)
+        index._mmap = mm
+        return index
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            is_binary = f.read(len(_GEO_INDEX_MAGIC)) == _GEO_INDEX_MAGIC
+        return cls.open(path) if is_binary else cls.from_csv(path)
+
+    def lookup(self, ip):
+        """Return a ``mapped`` geo dict for ``ip``, or None when no range covers it."""
+        try:
+            parsed = ipaddress.ip_address(ip)
+        except ValueError:
+            return None
+        columns = self._families[parsed.version]
+        index = columns.find(parsed.packed)
+        if index is None:
+            self._stats['misses'] += 1
+            return None
+        self._stats['hits'] += 1
+        city, country = self.locations[columns.loc[index]]
+        return {
+            'geocode_status': 'mapped',
+            'lat': round(float(columns.lat[index]), 1),
+            'lon': round(float(columns.lon[index]), 1),
+            'city': city,
+            'region': '',
+            'country': country,
+        }
+
+    def stats(self):
+        return dict(self._stats, ranges=len(self), source=self.source, mmapped=self._mmap is not None)
+
+
+def _load_offline_geo_index():
+    if os.getenv('GEOCODE_BACKEND', 'ipinfo').strip().lower() != 'offline':
+        return None
+    path = os.getenv('GEO_RANGES_FILE', os.path.join(_data_dir, 'geo_ranges.bin'))
     try:
-        with _visitor_db() as conn:
-            conn.execute(
+        return OfflineGeoIndex.load(path)
+    except (OSError, ValueError, struct.error) as e:
+        print(f'Offline geocoding disabled: could not load {path}: {e}')
+        return None
+
+
+_offline_geo = _load_offline_geo_index()
+
+
+def _geocode_ip_offline(ip):
+    if _offline_geo is None or not ip or is_private_ip(ip):
+        return None
+    return _offline_geo.lookup(ip)
+
+
+def _ip_cache_key(ip):
+    """Salted hash of the IP's /24 (IPv4) or /48 (IPv6) network.
+
+    Neighbouring addresses geocode to the same rounded city-level point, and
+    hashing the truncated prefix keeps raw addresses out of the cache.
+    """
+    parsed = ipaddress.ip_address(ip)
+    prefix = 24 if parsed.version == 4 else 48
+    network = ipaddress.ip_network(f'{parsed}/{prefix}', strict=False)
+    return hashlib.sha256(f'{_geo_cache_salt()}|{network}'.encode('utf-8')).hexdigest()[:32]
+
+
+_DEFAULT_SECRET_KEY = 'dev-secret-change-in-production'
+_geo_cache_salt_value = None
+
+
+def _geo_cache_salt():
+    """GEO_CACHE_SALT, else a real SECRET_KEY, else the random salt stored in the DB.
+
+    The default SECRET_KEY is public, so it is never used as the salt. If the
+    stored salt cannot be read, a per-process random one keeps keys private
+    at the cost of cache hits across workers and restarts.
+    """
+    global _geo_cache_salt_value
+    if _geo_cache_salt_value is None:
+        salt = os.getenv('GEO_CACHE_SALT')
+        if not salt and app.secret_key != _DEFAULT_SECRET_KEY:
+            salt = app.secret_key
+        if not salt:
+            try:
+                with _visitor_db() as conn:
+                    row = conn.execute(
+                        "SELECT value FROM visitor_secrets WHERE name = 'geo_cache_salt'"
+                    ).fetchone()
+                salt = row[0] if row else None
+            except sqlite3.Error:
+                salt = None
+        _geo_cache_salt_value = salt or secrets.token_hex(32)
+    return _geo_cache_salt_value
+
+
+class _GeoCache:
+    """In-memory LRU in front of the ``geo_cache`` SQLite table.
+
+    Only definitive answers (``mapped``/``no_location``) are cached, each for
+    ``ttl`` seconds. Lookups fall through memory -> SQLite -> ipinfo.
+    """
+
+    _CACHEABLE = ('mapped', 'no_location')
+
+    def __init__(self, max_entries, ttl_seconds):
+        self.max_entries = max(max_entries, 0)
+        self.ttl = ttl_seconds
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._puts = 0
+        self._stats = {'memory_hits': 0, 'db_hits': 0, 'misses': 0, 'expired': 0, 'stores': 0}
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0 and self.ttl > 0
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self._stats['memory_hits'] += 1
+                    return dict(entry[1])
+                del self._entries[key]
+        try:
+            with _visitor_db() as conn:
+                row = conn.execute(
+                    "SELECT payload, expires_at FROM geo_cache WHERE key = ?", (key,)
+                ).fetchone()
+        except sqlite3.Error:
+            row = None
+        if row is not None and row['expires_at'] > now:
+            geo = json.loads(row['payload'])
+            self._remember(key, geo, row['expires_at'])
+            self._stats['db_hits'] += 1
+            return dict(geo)
+        self._stats['expired' if row is not None else 'misses'] += 1
+        return None
+
+    def _remember(self, key, geo, expires_at):
+        with self._lock:
+            self._entries[key] = (expires_at, geo)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def put(self, key, geo):
+        if geo.get('geocode_status') not in self._CACHEABLE:
+            return
+        now = time.time()
+        expires_at = now + self.ttl
+        self._remember(key, geo, expires_at)
+        self._stats['stores'] += 1
+        self._puts += 1
+        try:
+            with _visitor_db() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO geo_cache (key, payload, expires_at) VALUES (?, ?, ?)",
+                    (key, json.dumps(geo), expires_at),
+                )
+                if self._puts % 256 == 0:
+                    conn.execute("DELETE FROM geo_cache WHERE expires_at <= ?", (now,))
+                conn.commit()
+        except sqlite3.Error:
+            pass
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        lookups = self._stats['memory_hits'] + self._stats['db_hits'] + self._stats['misses'] + self._stats['expired']
+        hits = self._stats['memory_hits'] + self._stats['db_hits']
+        with self._lock:
+            size = len(self._entries)
+        return dict(
+            self._stats,
+            memory_entries=size,
+            max_entries=self.max_entries,
+            hit_rate=round(hits / lookups, 4) if lookups else 0.0,
+        )
+
+
+_geo_cache = _GeoCache(
+    max_entries=int(os.getenv('GEO_CACHE_SIZE', '2048')),
+    ttl_seconds=float(os.getenv('GEO_CACHE_TTL_HOURS', '168')) * 3600,
+)
+
+
+def _geocode_ip(ip):
+    if not ip or is_private_ip(ip):
+        return {'geocode_status': 'local_or_private'}
+    geo = _geocode_ip_offline(ip)
+    if geo is not None:
+        return geo
+    if not _geo_cache.enabled:
+        return _geocode_ip_remote(ip)
+    key = _ip_cache_key(ip)
+    geo = _geo_cache.get(key)
+    if geo is None:
+        geo = _geocode_ip_remote(ip)
+        _geo_cache.put(key, geo)
+    return geo
+
+
+def _geocode_should_retry(status):
+    return status in ('lookup_failed', 'http_429') or status.startswith('http_5')
+
+
+# Rollup rows carry the Web Mercator quadkey of their tile at this level. A
+# quadkey prefix of length z is the zoom-z tile containing the point, so
+# grouping by a prefix clusters pins into fixed screen-space cells.
+_QUADKEY_LEVEL = 16
+_MERCATOR_MAX_LAT = 85.05112878
+
+
+def _quadkey(lat, lon, level=_QUADKEY_LEVEL):
+    lat = max(min(lat, _MERCATOR_MAX_LAT), -_MERCATOR_MAX_LAT)
+    sin_lat = math.sin(math.radians(lat))
+    x = (lon + 180.0) / 360.0
+    y = 0.5 - math.log((1 + sin_lat) / (1 - sin_lat)) / (4 * math.pi)
+    size = 1 << level
+    tile_x = min(max(int(x * size), 0), size - 1)
+    tile_y = min(max(int(y * size), 0), size - 1)
+    digits = []
+    for i in range(level, 0, -1):
+        mask = 1 << (i - 1)
+        digits.append(str((1 if tile_x & mask else 0) + (2 if tile_y & mask else 0)))
+    return ''.join(digits)
+
+
+def _bump_location_rollup(conn, geos):
+    """Count mapped visits into visitor_location_rollup; caller owns the transaction."""
+    rows = [
+        (geo['lat'], geo['lon'], geo.get('city') or '', geo.get('country') or '', _quadkey(geo['lat'], geo['lon']))
+        for geo in geos
+        if geo.get('lat') is not None and geo.get('lon') is not None
+    ]
+    if rows:
+        conn.executemany(
+            """
+            INSERT INTO visitor_location_rollup (lat, lon, city, country, quadkey, count)
+            VALUES (?, ?, ?, ?, ?, 1)
+            ON CONFLICT (lat, lon, city, country) DO UPDATE SET count = count + 1
+            """,
+            rows,
+        )
+        conn.execute("UPDATE visitor_counter SET locations_version = locations_version + 1 WHERE id = 1")
+
+
+def _update_visitor_event_location(event_id, geo):
+    """Store a finished lookup and retire its geocode job in one transaction.
+
+    Only a still-pending event is updated, so a job that runs twice (for
+    example after its lease lapsed mid-lookup) cannot double-count the rollup.
+    """
+    with _visitor_db() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        cur = conn.execute(
+            """
+            UPDATE visitor_events
+               SET updated_at = ?,
+                   country = ?,
+                   region = ?,
+                   city = ?,
+                   lat = ?,
+                   lon = ?,
+                   geocode_status = ?
+             WHERE id = ? AND geocode_status = 'pending'
+            """,
+            (
+                _utc_iso(),
+                geo.get('country', ''),
+                geo.get('region', ''),
+                geo.get('city', ''),
+                geo.get('lat'),
+                geo.get('lon'),
+                geo.get('geocode_status', 'lookup_failed'),
+                event_id,
+            ),
+        )
+        if cur.rowcount:
+            _bump_location_rollup(conn, [geo])
+        conn.execute("DELETE FROM geocode_jobs WHERE event_id = ?", (event_id,))
+        conn.commit()
+
+
+def _reschedule_geocode_job(event_id, attempts, due, lease_until):
+    with _visitor_db() as conn:
+        conn.execute(
+            "UPDATE geocode_jobs SET attempts = ?, next_attempt_at = ?, lease_until = ? WHERE event_id = ?",
+            (attempts, due, lease_until, event_id),
+        )
+        conn.commit()
+
+
+def _claim_geocode_jobs(limit, lease_seconds):
+    """Lease up to ``limit`` due jobs whose previous lease has lapsed.
+
+    Covers jobs left behind by a restart, a crashed worker, or a full queue.
+    The claim runs under SQLite's write lock so two workers never take the
+    same job.
+    """
+    now = time.time()
+    with _visitor_db() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        rows = conn.execute(
+            """
+            SELECT event_id, ip, attempts
+              FROM geocode_jobs
+             WHERE lease_until <= ? AND next_attempt_at <= ?
+             ORDER BY next_attempt_at
+             LIMIT ?
+            """,
+            (now, now, limit),
+        ).fetchall()
+        conn.executemany(
+            "UPDATE geocode_jobs SET lease_until = ? WHERE event_id = ?",
+            [(now + lease_seconds, row['event_id']) for row in rows],
+        )
+        conn.commit()
+    return [(row['event_id'], row['ip'], int(row['attempts'])) for row in rows]
+
+
+class _GeocodeWorkerPool:
+    """Fixed-size geocoding executor fed by a bounded in-memory queue.
+
+    Every job is also a ``geocode_jobs`` row written in the visit's own
+    transaction, holding the IP only until the lookup finishes. The queue is
+    just the fast path: a job that is dropped because the queue is full, or
+    lost to a restart, is picked up again by the scheduler once its lease
+    lapses. Retryable failures back off exponentially up to ``max_attempts``.
+    """
+
+    def __init__(self, workers, queue_size, max_attempts, backoff_seconds, lease_seconds, resume_interval):
+        self.workers = max(workers, 0)
+        self.queue_size = max(queue_size, 1)
+        self.max_attempts = max(max_attempts, 1)
+        self.backoff_seconds = backoff_seconds
+        self.lease_seconds = lease_seconds
+        self.resume_interval = resume_interval
+        self._cond = threading.Condition()
+        self._queue = queue.Queue(maxsize=self.queue_size)
+        self._delayed = []
+        self._pid = None
+        self._in_flight = 0
+        self._stats = {'submitted': 0, 'dropped': 0, 'completed': 0, 'failed': 0, 'retried': 0, 'resumed': 0, 'errors': 0}
+        self._latency = {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'last_ms': 0.0}
+
+    @property
+    def enabled(self):
+        return self.workers > 0
+
+    def start(self):
+        """Start the workers for this process (again, after a fork)."""
+        if not self.enabled or self._pid == os.getpid():
+            return
+        with self._cond:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._queue = queue.Queue(maxsize=self.queue_size)
+            self._delayed = []
+            self._in_flight = 0
+            for i in range(self.workers):
+                threading.Thread(target=self._work, name=f'geocode-{i}', daemon=True).start()
+            threading.Thread(target=self._schedule, name='geocode-scheduler', daemon=True).start()
+
+    def submit(self, event_id, ip, attempts=0):
+        if not self.enabled:
+            return False
+        self.start()
+        try:
+            self._queue.put_nowait((event_id, ip, attempts))
+        except queue.Full:
+            self._stats['dropped'] += 1
+            return False
+        self._stats['submitted'] += 1
+        return True
+
+    def _work(self):
+        while True:
+            event_id, ip, attempts = self._queue.get()
+            with self._cond:
+                self._in_flight += 1
+            started = time.perf_counter()
+            try:
+                self._run_job(event_id, ip, attempts)
+            except Exception:
+                self._stats['errors'] += 1
+            finally:
+                elapsed_ms = (time.perf_counter() - started) * 1000
+                with self._cond:
+                    self._in_flight -= 1
+                    self._latency['count'] += 1
+                    self._latency['total_ms'] += elapsed_ms
+                    self._latency['last_ms'] = elapsed_ms
+                    self._latency['max_ms'] = max(self._latency['max_ms'], elapsed_ms)
+
+    def _run_job(self, event_id, ip, attempts):
+        geo = _geocode_ip(ip)
+        status = geo.get('geocode_status', 'lookup_failed')
+        attempts += 1
+        if _geocode_should_retry(status) and attempts < self.max_attempts:
+            delay = min(self.backoff_seconds * 2 ** (attempts - 1), 300) * random.uniform(0.8, 1.2)
+            due = time.time() + delay
+            _reschedule_geocode_job(event_id, attempts, due, due + self.lease_seconds)
+            with self._cond:
+                heapq.heappush(self._delayed, (due, event_id, ip, attempts))
+                self._cond.notify()
+            self._stats['retried'] += 1
+            return
+        _update_visitor_event_location(event_id, geo)
+        self._stats['completed' if status == 'mapped' else 'failed'] += 1
+
+    def _schedule(self):
+        next_resume = 0.0
+        while True:
+            now = time.time()
+            ready = []
+            with self._cond:
+                while self._delayed and self._delayed[0][0] <= now:
+                    ready.append(heapq.heappop(self._delayed)[1:])
+            for event_id, ip, attempts in ready:
+                self.submit(event_id, ip, attempts)
+            if now >= next_resume:
+                next_resume = now + self.resume_interval
+                free = self.queue_size - self._queue.qsize()
+                if free > 0:
+                    try:
+                        jobs = _claim_geocode_jobs(free, self.lease_seconds)
+                    except Exception:
+                        jobs = []
+                        self._stats['errors'] += 1
+                    for event_id, ip, attempts in jobs:
+                        if self.submit(event_id, ip, attempts):
+                            self._stats['resumed'] += 1
+            with self._cond:
+                wake_at = next_resume
+                if self._delayed:
+                    wake_at = min(wake_at, self._delayed[0][0])
+                self._cond.wait(max(wake_at - time.time(), 0.05))
+
+    def stats(self):
+        with self._cond:
+            latency = dict(self._latency)
+            in_flight = self._in_flight
+            delayed = len(self._delayed)
+        latency['avg_ms'] = latency['total_ms'] / latency['count'] if latency['count'] else 0.0
+        return dict(
+            self._stats,
+            workers=self.workers,
+            queue_depth=self._queue.qsize(),
+            queue_size=self.queue_size,
+            in_flight=in_flight,
+            delayed=delayed,
+            latency_ms={k: round(v, 2) for k, v in latency.items() if k != 'total_ms'},
+        )
+
+
+_geocoder = _GeocodeWorkerPool(
+    workers=int(os.getenv('GEOCODE_WORKERS', '2')),
+    queue_size=int(os.getenv('GEOCODE_QUEUE_SIZE', '256')),
+    max_attempts=int(os.getenv('GEOCODE_MAX_ATTEMPTS', '5')),
+    backoff_seconds=float(os.getenv('GEOCODE_BACKOFF_SECONDS', '2')),
+    lease_seconds=600,
+    resume_interval=60,
+)
+
+
+class _VisitRateLimiter:
+    """Fixed-memory, per-process visit de-duplication.
+
+    A rotating pair of count-min sketches counts visits per salted hash of
+    (client IP, UA family). Generations rotate every ``window / 2`` seconds and
+    a key's estimate is the sum of both, so a visit is remembered for between
+    half and one full window. Count-min only over-estimates, so the failure
+    mode is dropping a rare legitimate visit, never letting a flood through.
+    The salt is random per process, so the hashes are useless outside it.
+
+    The default allowance is several visits per window because one key can be
+    many people behind a shared NAT. State is per worker: a repeat that lands
+    on another gunicorn worker is counted again, so this caps refresh floods
+    rather than giving exact unique-visitor counts.
+    """
+
+    def __init__(self, max_per_window, window_seconds, memory_kb, depth=4):
+        self.max_per_window = max(max_per_window, 0)
+        self.window = max(window_seconds, 1)
+        self.depth = depth
+        # Two generations of uint16 counters share the memory budget.
+        self.width = max((memory_kb * 1024) // (2 * 2 * depth), 64)
+        self._salt = secrets.token_bytes(16)
+        self._lock = threading.Lock()
+        self._current = array('H', bytes(2 * self.width * depth))
+        self._previous = array('H', bytes(2 * self.width * depth))
+        self._generation = self._generation_for(time.time())
+        self._stats = {'allowed': 0, 'limited': 0, 'rotations': 0}
+
+    @property
+    def enabled(self):
+        return self.max_per_window > 0
+
+    def _generation_for(self, now):
+        return int(now // (self.window / 2))
+
+    def _slots(self, key):
+        digest = hashlib.blake2b(key.encode('utf-8'), key=self._salt, digest_size=4 * self.depth).digest()
+        return [
+            row * self.width + int.from_bytes(digest[row * 4:row * 4 + 4], 'little') % self.width
+            for row in range(self.depth)
+        ]
+
+    def _rotate(self, now):
+        generation = self._generation_for(now)
+        if generation <= self._generation:
+            return
+        if generation == self._generation + 1:
+            self._previous, self._current = self._current, self._previous
+        else:
+            self._previous = array('H', bytes(2 * self.width * self.depth))
+        self._current = array('H', bytes(2 * self.width * self.depth))
+        self._generation = generation
+        self._stats['rotations'] += 1
+
+    def allow(self, ip, family):
+        """Count one visit for this client; False once it is over the limit."""
+        if not self.enabled:
+            return True
+        slots = self._slots(f'{ip}|{family}')
+        with self._lock:
+            self._rotate(time.time())
+            seen = min(self._current[i] + self._previous[i] for i in slots)
+            if seen >= self.max_per_window:
+                self._stats['limited'] += 1
+                return False
+            for i in slots:
+                if self._current[i] < 0xFFFF:
+                    self._current[i] += 1
+            self._stats['allowed'] += 1
+        return True
+
+    def stats(self):
+        return dict(
+            self._stats,
+            max_per_window=self.max_per_window,
+            window_seconds=self.window,
+            memory_bytes=2 * 2 * self.width * self.depth,
+        )
+
+
+_visit_limiter = _VisitRateLimiter(
+    max_per_window=int(os.getenv('VISIT_DEDUPE_MAX', '10')),
+    window_seconds=int(os.getenv('VISIT_DEDUPE_WINDOW_SECONDS', '1800')),
+    memory_kb=int(os.getenv('VISIT_DEDUPE_MEMORY_KB', '256')),
+)
+
+
+def _visit_event_from_request():
+    """Capture everything a visit row needs while the request is still live."""
+    ip = get_real_ip()
+    private = is_private_ip(ip)
+    event = {
+        'id': secrets.token_urlsafe(12),
+        'created_at': _utc_iso(),
+        'path': _visit_path_from_request(),
+        'referrer_host': _referrer_host(),
+        'user_agent_family': _ua_family(),
+        'geocode_status': 'local_or_private' if private else 'pending',
+        'ip': '' if private else ip,
+        'geo': {},
+    }
+    # A local range hit is cheap enough to resolve inline, skipping the job queue.
+    geo = None if private else _geocode_ip_offline(ip)
+    if geo is not None:
+        event.update(geocode_status=geo['geocode_status'], ip='', geo=geo)
+    elif not private and not _geocoder.enabled:
+        # With lookups disabled no worker would ever process (and delete) a
+        # geocode job, so the IP is not queued at all.
+        event.update(geocode_status='skipped', ip='')
+    return event
+
+
+# RETURNING needs SQLite 3.35+; older builds read the row back inside the same
+# write transaction, which is just as atomic, only one statement longer.
+_SQLITE_HAS_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+
+def _increment_visit_counter(conn, amount, now):
+    """Atomically add ``amount`` to the counter; caller holds a write transaction."""
+    if _SQLITE_HAS_RETURNING:
+        row = conn.execute(
+            "UPDATE visitor_counter SET count = count + ?, updated_at = ? WHERE id = 1 RETURNING count",
+            (amount, now),
+        ).fetchone()
+    else:
+        conn.execute(
+            "UPDATE visitor_counter SET count = count + ?, updated_at = ? WHERE id = 1",
+            (amount, now),
+        )
+        row = conn.execute("SELECT count FROM visitor_counter WHERE id = 1").fetchone()
+    return int(row[0])
+
+
+def _write_visit_events(events):
+    """Insert a batch of visit events behind one counter increment.
+
+    Returns the counter value assigned to each event, in order. The whole batch
+    shares one transaction, one counter UPDATE and, once committed, one
+    mirror write.
+
+    ``BEGIN IMMEDIATE`` takes SQLite's database-wide write lock, so the
+    increment and the sequence numbers it hands out are serialized across every
+    gunicorn worker, not just the threads of this one. The unique index on
+    ``visitor_events.sequence`` backs that up.
+    """
+    if not events:
+        return []
+    now = _utc_iso()
+    with _visitor_db() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            last = _increment_visit_counter(conn, len(events), now)
+            counts = list(range(last - len(events) + 1, last + 1))
+            conn.executemany(
                 """
-                UPDATE visitor_events
-                   SET updated_at = ?,
-                       country = ?,
-                       region = ?,
-                       city = ?,
-                       lat = ?,
-                       lon = ?,
-                       geocode_status = ?
-                 WHERE id = ?
+                INSERT INTO visitor_events
+                    (id, sequence, created_at, updated_at, path, referrer_host, user_agent_family,
+                     country, region, city, lat, lon, geocode_status)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
                 """,
-                (
-                    _utc_iso(),
-                    geo.get('country', ''),
-                    geo.get('region', ''),
-                    geo.get('city', ''),
-                    geo.get('lat'),
-                    geo.get('lon'),
-                    geo.get('geocode_status', 'lookup_failed'),
-                    event_id,
-                ),
+                [
+                    (
+                        event['id'],
+                        count,
+                        event['created_at'],
+                        now,
+                        event['path'],
+                        event['referrer_host'],
+                        event['user_agent_family'],
+                        event['geo'].get('country'),
+                        event['geo'].get('region'),
+                        event['geo'].get('city'),
+                        event['geo'].get('lat'),
+                        event['geo'].get('lon'),
+                        event['geocode_status'],
+                    )
+                    for event, count in zip(events, counts)
+                ],
             )
+            _bump_location_rollup(conn, [event['geo'] for event in events])
+            jobs = [event for event in events if event['ip']]
+            if jobs:
+                lease_until = time.time() + _geocoder.lease_seconds
+                conn.executemany(
+                    """
+                    INSERT INTO geocode_jobs (event_id, ip, attempts, next_attempt_at, lease_until, created_at)
+                    VALUES (?, ?, 0, 0, ?, ?)
+                    """,
+                    [(event['id'], event['ip'], lease_until, now) for event in jobs],
+                )
             conn.commit()
-    except Exception:
-        pass
+        except Exception:
+            conn.rollback()
+            raise
+    # Only a committed count reaches the mirror.
+    _write_visit_count_mirror(last)
+    _visit_count_cache.store(last)
+    for event in events:
+        if event['ip']:
+            _geocoder.submit(event['id'], event['ip'])
+    return counts
+
+
+class _VisitGroupCommit:
+    """Leader-driven group commit for POST /api/visit.
+
+    A request that finds no commit in flight becomes the leader and commits
+    straight away, together with whatever else is queued, so a lone visit
+    costs the same as direct mode. Requests that arrive while a commit is
+    running queue up behind it; when it finishes, one of them leads the next
+    commit for the whole queue (up to ``max_batch`` events). Batching only
+    happens when one process serves requests concurrently, i.e. with a
+    threaded gunicorn worker (``--threads`` / gthread); under sync workers
+    every batch has exactly one event.
+    """
+
+    def __init__(self, max_batch):
+        self.max_batch = max(max_batch, 1)
+        self._cond = threading.Condition()
+        self._pending = []
+        self._leading = False
+        self._stats = {'commits': 0, 'events': 0, 'max_batch_seen': 0}
+
+    def submit(self, event, timeout=10):
+        slot = {'event': event, 'done': False, 'count': None, 'error': None}
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self._pending.append(slot)
+            while not slot['done']:
+                if not self._leading:
+                    self._lead()
+                    continue
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    queued = next((i for i, other in enumerate(self._pending) if other is slot), None)
+                    if queued is not None:
+                        del self._pending[queued]
+                        raise TimeoutError('visit group commit timed out')
+                    # Already in the leader's batch: it will be committed (or
+                    # fail) either way, so wait for the outcome rather than
+                    # report a visit that is about to be counted as failed.
+                    self._cond.wait()
+                    continue
+                self._cond.wait(remaining)
+        if slot['error'] is not None:
+            raise slot['error']
+        return slot['count']
+
+    def _lead(self):
+        # Caller holds self._cond; it is released for the commit itself.
+        self._leading = True
+        batch = self._pending[:self.max_batch]
+        del self._pending[:self.max_batch]
+        self._cond.release()
+        try:
+            counts = _write_visit_events([slot['event'] for slot in batch])
+            error = None
+        except Exception as e:
+            counts, error = [None] * len(batch), e
+        finally:
+            self._cond.acquire()
+        for slot, count in zip(batch, counts):
+            slot['count'] = count
+            slot['error'] = error
+            slot['done'] = True
+        self._stats['commits'] += 1
+        self._stats['events'] += len(batch)
+        self._stats['max_batch_seen'] = max(self._stats['max_batch_seen'], len(batch))
+        self._leading = False
+        self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return dict(self._stats, max_batch=self.max_batch, queued=len(self._pending))
+
+
+_visit_ingest_mode = os.getenv('VISIT_INGEST_MODE', 'direct').strip().lower()
+_visit_group_commit = None
+if _visit_ingest_mode == 'buffered':
+    _visit_group_commit = _VisitGroupCommit(max_batch=int(os.getenv('VISIT_FLUSH_MAX', '64')))
 
 
 def _record_visit_event():
@@ -265,90 +1562,157 @@ def _record_visit_event():
 
     Raw IPs and full user agents are intentionally not stored. The event is
     inserted before geolocation so the footer count and event count stay
-    aligned even if the third-party lookup fails.
+    aligned even if the third-party lookup fails. With
+    ``VISIT_INGEST_MODE=buffered`` the insert is group-committed with other
+    concurrent visits instead of taking its own transaction.
     """
-    _ensure_visitor_db()
-    now = _utc_iso()
-    event_id = secrets.token_urlsafe(12)
-    ip = get_real_ip()
-    with _visit_lock:
-        with _visitor_db() as conn:
-            conn.execute("BEGIN IMMEDIATE")
-            row = conn.execute("SELECT count FROM visitor_counter WHERE id = 1").fetchone()
-            current = int(row['count']) if row else _legacy_visit_count()
-            count = current + 1
-            conn.execute(
-                "UPDATE visitor_counter SET count = ?, updated_at = ? WHERE id = 1",
-                (count, now),
-            )
-            conn.execute(
-                """
-                INSERT INTO visitor_events
-                    (id, sequence, created_at, updated_at, path, referrer_host, user_agent_family, geocode_status)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                """,
-                (
-                    event_id,
-                    count,
-                    now,
-                    now,
-                    _visit_path_from_request(),
-                    _referrer_host(),
-                    _ua_family(),
-                    'pending' if not is_private_ip(ip) else 'local_or_private',
-                ),
-            )
-            conn.commit()
-        _write_visit_count_mirror(count)
-    if not is_private_ip(ip):
-        threading.Thread(target=_update_visitor_event_location, args=(event_id, ip), daemon=True).start()
-    return count
+    event = _visit_event_from_request()
+    if _visit_group_commit is not None:
+        return _visit_group_commit.submit(event)
+    return _write_visit_events([event])[0]
+
+# Bring the visitor DB schema up to date once per process at startup. Deploys
+# that run `flask migrate-visitor-db` as a release step can set
+# VISITOR_DB_AUTO_MIGRATE=0 to skip it.
+if os.getenv('VISITOR_DB_AUTO_MIGRATE', '1') != '0':
+    migrate_visitor_db()
+
+
+def _skip_geocode_jobs():
+    """Retire every queued lookup without running it, deleting the stored IPs."""
+    with _visitor_db() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute(
+            """
+            UPDATE visitor_events SET geocode_status = 'skipped', updated_at = ?
+             WHERE geocode_status = 'pending' AND id IN (SELECT event_id FROM geocode_jobs)
+            """,
+            (_utc_iso(),),
+        )
+        cur = conn.execute("DELETE FROM geocode_jobs")
+        conn.commit()
+    return cur.rowcount
+
 
-# Initialize visitor DB on startup
-_ensure_visitor_db()
+# Jobs queued while lookups were enabled would otherwise keep their IPs forever.
+if not _geocoder.enabled:
+    try:
+        _skip_geocode_jobs()
+    except sqlite3.Error:
+        pass
+
+
+@app.cli.command('build-geo-index')
+@click.argument('csv_path')
+@click.argument('output_path')
+def build_geo_index_command(csv_path, output_path):
+    """Compile a start,end,lat,lon,city,country CSV into a memory-mappable index."""
+    index = OfflineGeoIndex.from_csv(csv_path)
+    index.save(output_path)
+    print(f'Wrote {len(index)} ranges, {len(index.locations)} locations to {output_path}')
+
+
+@app.cli.command('rollup-visitor-stats')
+def rollup_visitor_stats_command():
+    """Fold new visitor events into the hourly/daily analytics rollups."""
+    total = 0
+    while True:
+        processed = refresh_visitor_stats()
+        if not processed:
+            break
+        total += processed
+    print(f'Rolled up {total} visitor events')
+
+
+@app.cli.command('compact-visitor-events')
+@click.option('--days', type=int, default=None, help='Retention window (default: VISITOR_RETENTION_DAYS or 365).')
+@click.option('--batch-size', type=int, default=1000, show_default=True)
+def compact_visitor_events_command(days, batch_size):
+    """Archive visitor events past the retention window and delete them."""
+    if days is None:
+        days = int(os.getenv('VISITOR_RETENTION_DAYS', '365'))
+    result = compact_visitor_events(days, batch_size=batch_size)
+    print(
+        f"Archived {result['archived']} events older than {result['cutoff']} "
+        f"to {_visitor_archive_dir}; reclaimed {result['pages_freed']} pages"
+    )
+
+
+@app.cli.command('export-site')
+@click.argument('output_dir')
+@click.option('--force', is_flag=True, help='Re-render every page even if its inputs are unchanged.')
+def export_site_command(output_dir, force):
+    """Prerender every HTML route and static asset into OUTPUT_DIR for CDN hosting."""
+    result = export_site(output_dir, force=force)
+    print(
+        f"Rendered {result['rendered']} pages ({result['unchanged']} unchanged, "
+        f"{result['removed']} removed); copied {result['static_copied']} static files to {output_dir}"
+    )
+
+
+@app.cli.command('migrate-visitor-db')
+def migrate_visitor_db_command():
+    """Apply pending visitor DB schema migrations."""
+    before, after = migrate_visitor_db()
+    if before == after:
+        print(f'Visitor DB already at version {after}')
+    else:
+        print(f'Visitor DB migrated {before} -> {after}')
 
 # Visits are recorded via POST /api/visit (triggered from base.html JS),
 # not in @before_request — so refreshes/asset re-requests don't double-count
 # and bots are filtered by user-agent.
 
+def _terminal_project_shape(p):
+    links = {}
+    if p.get('hasLive')     and p.get('liveLink'):     links['live']     = p['liveLink']
+    if p.get('hasGithub')   and p.get('githubLink'):   links['github']   = p['githubLink']
+    if p.get('hasVideo')    and p.get('videoLink'):    links['video']    = p['videoLink']
+    if p.get('hasDownload') and p.get('downloadLink'): links['download'] = p['downloadLink']
+    return {
+        'id': p.get('id', ''),
+        'title': p.get('title', ''),
+        'links': links,
+    }
+
+
 def get_terminal_projects():
     """Compact project id/title/link payload for the in-page terminal filesystem."""
     try:
-        projects = load_projects()
+        return project_catalog.terminal_payload()
     except Exception:
         return {'personal': [], 'academic': []}
 
-    def shape(p):
-        links = {}
-        if p.get('hasLive')     and p.get('liveLink'):     links['live']     = p['liveLink']
-        if p.get('hasGithub')   and p.get('githubLink'):   links['github']   = p['githubLink']
-        if p.get('hasVideo')    and p.get('videoLink'):    links['video']    = p['videoLink']
-        if p.get('hasDownload') and p.get('downloadLink'): links['download'] = p['downloadLink']
-        return {
-            'id': p.get('id', ''),
-            'title': p.get('title', ''),
-            'links': links,
-        }
 
-    return {
-        'personal': [shape(p) for p in projects.get('personal', []) if p.get('id')],
-        'academic': [shape(p) for p in projects.get('academic', []) if p.get('id')],
-    }
+@app.before_request
+def start_background_workers():
+    # Cheap pid check after the first call; also restarts workers in forked children.
+    _geocoder.start()
 
 
 @app.context_processor
 def inject_feature_flags():
     """Make feature flags available to all templates"""
+    from flask import g
     return {
         'show_resume': SHOW_RESUME,
-        'visit_count': get_authoritative_visit_count(),
+        'visit_count': (
+            _LateBoundVisitCount() if g.get('late_bound_visit_count') else get_authoritative_visit_count()
+        ),
         'image_url': static_image_url,
+        'image_srcset': static_image_srcset,
+        'resized_image_url': resized_image_url,
+        'vendor_url': vendor_asset_url,
         'terminal_projects': get_terminal_projects(),
     }
 
-# Image extensions to look for
-IMAGE_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.gif', '.svg', '.webp'}
-WEBP_SOURCE_EXTENSIONS = {'.png', '.jpg', '.jpeg'}
+# Every file under static/, indexed once at startup so image helpers never
+# touch the filesystem on the request path (see static_assets.py).
+asset_manifest = StaticAssetManifest(
+    'static',
+    manifest_path=os.getenv('ASSET_MANIFEST_FILE', 'asset-manifest.json'),
+    refresh_seconds=float(os.getenv('ASSET_MANIFEST_REFRESH_SECONDS', '0')),
+).load()
 
 
 def normalize_static_path(path):
@@ -361,12 +1725,7 @@ def static_path_to_abspath(path):
 
 def prefer_webp_asset(path):
     normalized = normalize_static_path(path)
-    stem, ext = os.path.splitext(normalized)
-    if ext.lower() in WEBP_SOURCE_EXTENSIONS:
-        webp_path = f'{stem}.webp'
-        if os.path.exists(static_path_to_abspath(webp_path)):
-            return webp_path
-    return normalized
+    return asset_manifest.webp_sibling(normalized) or normalized
 
 
 def dedupe_image_paths(paths):
@@ -386,24 +1745,792 @@ def static_image_url(path):
     return url_for('static', filename=prefer_webp_asset(path))
 
 
+def static_image_srcset(path, sizes):
+    """``srcset``/``sizes`` attributes for an image's width ladder.
+
+    Renders nothing when the image has no variants, so templates can add it
+    to any <img> next to ``image_url``.
+    """
+    ladder = asset_manifest.variants(normalize_static_path(path))
+    if not ladder:
+        return Markup('')
+    full_width, variants = ladder
+    candidates = [f'{static_image_url(rel)} {width}w' for width, rel in variants]
+    candidates.append(f'{static_image_url(path)} {full_width}w')
+    return Markup('srcset="{}" sizes="{}"').format(', '.join(candidates), sizes)
+
+
+# Fingerprinted static URLs: url_for('static', ...) gains ?v=<content hash>
+# from the asset manifest, and requests carrying the current hash are cached
+# for a year. A changed file gets a new hash, hence a new URL.
+STATIC_IMMUTABLE_MAX_AGE = 31536000
+
+# Vendored bundles load their own files by relative URL, which ?v= cannot
+# reach, so the whole directory is versioned in the path instead:
+# /static/vendor/<package>~<tree hash>/<file>.
+_VERSIONED_VENDOR_RE = re.compile(r'^vendor/([^/~]+)~([0-9a-f]+)/(.+)$')
+
+
+def split_vendor_version(path):
+    """``(real path, package dir, version)`` for a versioned vendor path, else ``(path, None, None)``."""
+    match = _VERSIONED_VENDOR_RE.match(path)
+    if not match:
+        return path, None, None
+    package, version, rest = match.groups()
+    return f'vendor/{package}/{rest}', f'vendor/{package}', version
+
+
+def vendor_asset_url(path):
+    """URL for ``<package>/<file>`` under static/vendor, fingerprinted by its whole package."""
+    package, _, rest = path.partition('/')
+    version = asset_manifest.tree_hash(f'vendor/{package}')
+    if version is None:
+        return url_for('static', filename=f'vendor/{path}')
+    return url_for('static', filename=f'vendor/{package}~{version}/{rest}')
+
+
+@app.url_defaults
+def add_static_fingerprint(endpoint, values):
+    if endpoint not in ('static', 'resized_image') or 'v' in values:
+        return
+    digest = asset_manifest.content_hash(normalize_static_path(values.get('filename', '')))
+    if digest:
+        values['v'] = digest
+
+
+@app.after_request
+def cache_fingerprinted_static(response):
+    from flask import request
+    if request.endpoint not in ('static', 'resized_image') or response.status_code not in (200, 206, 304):
+        return response
+    filename, package, version = split_vendor_version(
+        normalize_static_path((request.view_args or {}).get('filename', ''))
+    )
+    if package is not None:
+        current = asset_manifest.tree_hash(package)
+    else:
+        version, current = request.args.get('v'), asset_manifest.content_hash(filename)
+    if version and version == current:
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = STATIC_IMMUTABLE_MAX_AGE
+        response.cache_control.immutable = True
+    return response
+
+
+# ============================================
+# CONTENT ENCODING
+# Static text assets are served from precompressed siblings (see
+# scripts/precompress_static.py) picked by Accept-Encoding, so no CPU is spent
+# compressing them per request. Dynamic HTML/JSON above GZIP_MIN_BYTES is
+# gzipped on the way out.
+# ============================================
+GZIP_MIN_BYTES = int(os.getenv('GZIP_MIN_BYTES', '1400'))
+GZIP_LEVEL = 6
+GZIP_MIMETYPES = {'text/html', 'application/json'}
+
+
+def _negotiate_encoding(accept_encodings, available):
+    """Best content-coding the client accepts among ``available``, or None.
+
+    Highest client q-value wins; ties go to the server's order (br, zstd, gzip).
+    """
+    best, best_q = None, 0
+    for encoding, _suffix in PRECOMPRESSED_ENCODINGS:
+        if encoding not in available:
+            continue
+        q = accept_encodings[encoding]
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def serve_static(filename):
+    from flask import request, send_from_directory
+    normalized, _package, _version = split_vendor_version(normalize_static_path(filename))
+    # With the default DATA_DIR the visitor DB lives under static/data.
+    if is_runtime_file(normalized):
+        abort(404)
+    available = asset_manifest.encodings(normalized)
+    if not available:
+        return app.send_static_file(normalized)
+    encoding = _negotiate_encoding(request.accept_encodings, available)
+    if encoding is None:
+        response = app.send_static_file(normalized)
+    else:
+        response = send_from_directory(
+            app.static_folder,
+            available[encoding],
+            mimetype=mimetypes.guess_type(normalized)[0] or 'application/octet-stream',
+            max_age=app.get_send_file_max_age(normalized),
+        )
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+# Same 'static' endpoint (url_for and the fingerprint hooks are unchanged),
+# but encoding-aware.
+app.view_functions['static'] = serve_static
+
+
+def _gzip_stream(chunks):
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+_GZIP_HEADER = b'\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff'  # no name, mtime 0
+
+
+def _deflate_segment(data, final):
+    """Raw deflate of ``data`` ending byte-aligned, so segments can be concatenated."""
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+
+
+def gzip_splice_segments(parts):
+    """Precompress text parts that are later joined around a per-request value.
+
+    Each part becomes its own sync-flushed deflate segment (the last one
+    final), so ``gzip_splice`` only has to compress the value itself.
+    """
+    encoded = [part.encode('utf-8') for part in parts]
+    return tuple(
+        (raw, _deflate_segment(raw, final=i == len(encoded) - 1)) for i, raw in enumerate(encoded)
+    )
+
+
+def gzip_splice(segments, value):
+    """Gzip body of the segments' parts joined with ``value``."""
+    sep = value.encode('utf-8')
+    sep_deflated = _deflate_segment(sep, final=False)
+    out = [_GZIP_HEADER]
+    crc = size = 0
+    for i, (raw, deflated) in enumerate(segments):
+        if i:
+            out.append(sep_deflated)
+            crc = zlib.crc32(sep, crc)
+            size += len(sep)
+        out.append(deflated)
+        crc = zlib.crc32(raw, crc)
+        size += len(raw)
+    out.append(struct.pack('<II', crc, size & 0xFFFFFFFF))
+    return b''.join(out)
+
+
+@app.after_request
+def gzip_dynamic_response(response):
+    from flask import request
+    if (
+        request.endpoint in ('static', 'resized_image')
+        or response.status_code not in (200, 304)
+        or response.direct_passthrough
+        or response.mimetype not in GZIP_MIMETYPES
+    ):
+        return response
+    # Whether this representation is gzipped depends on Accept-Encoding, so
+    # every answer for it says so -- identity, small and 304 ones included
+    # (this also covers the page cache's identity hits).
+    response.vary.add('Accept-Encoding')
+    if (
+        response.status_code != 200
+        or 'Content-Encoding' in response.headers
+        or 'no-transform' in response.headers.get('Cache-Control', '')
+        or request.accept_encodings['gzip'] <= 0
+    ):
+        return response
+    if response.is_streamed:
+        # Compress chunk by chunk as the generator produces them.
+        response.response = _gzip_stream(response.response)
+        response.headers.pop('Content-Length', None)
+    else:
+        body = response.get_data()
+        if len(body) < GZIP_MIN_BYTES:
+            return response
+        response.set_data(gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0))
+    response.headers['Content-Encoding'] = 'gzip'
+    # The gzipped bytes differ from the identity ones, so a strong validator
+    # may no longer be used; a weak one still matches If-None-Match.
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+# ============================================
+# ON-DEMAND IMAGE RESIZING
+# /img/<width>/<static path> renders a WebP of any image in the asset manifest
+# through the converter's pipeline (EXIF transpose, LANCZOS, WebP) for sizes
+# not worth pre-generating. Renders are cached on disk under a byte budget.
+# ============================================
+IMAGE_RESIZE_WIDTHS = frozenset(
+    int(w) for w in os.getenv('IMAGE_RESIZE_WIDTHS', '160,320,480,640,960,1280').split(',') if w.strip()
+)
+IMAGE_RESIZE_QUALITY = 82
+RESIZABLE_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.webp'}
+
+
+class _ResizedImageCache:
+    """Rendered images on disk, bounded to ``max_bytes`` with LRU eviction.
+
+    A hit is a dict lookup plus a utime, so the file's mtime tracks recency
+    for every worker sharing the directory. Concurrent misses for the same
+    key wait on one render (single-flight). Files are renamed into place
+    atomically. Eviction rescans the directory, at most every
+    ``rescan_seconds`` and outside the lock, so it sees what other workers
+    wrote without stalling this worker's other requests; in between it trims
+    from the in-memory view. It trims to ``low_water`` of the budget so the
+    next few inserts do not evict again.
+    """
+
+    _FILE_RE = re.compile(r'^([0-9a-f]{32})\.webp$')
+    # Temp files this old were left by a crashed render, not one in progress.
+    STALE_TEMP_SECONDS = 3600
+
+    def __init__(self, directory, max_bytes, low_water=0.9, rescan_seconds=60.0):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.low_water = low_water
+        self.rescan_seconds = rescan_seconds
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> size, least recently used first
+        self._total = 0
+        self._inflight = {}
+        self._loaded = False
+        self._scanning = False
+        self._scanned_at = 0.0
+        self._stats = {'hits': 0, 'misses': 0, 'coalesced': 0, 'evictions': 0, 'scans': 0}
+
+    def _path(self, key):
+        return os.path.join(self.directory, f'{key}.webp')
+
+    def _scan(self):
+        """Cache entries on disk, least recently used first; touches no shared state."""
+        os.makedirs(self.directory, exist_ok=True)
+        found = []
+        stale_before = time.time() - self.STALE_TEMP_SECONDS
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                match = self._FILE_RE.match(entry.name)
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                if match is None:
+                    # Only cache entries are counted or evicted; in-progress
+                    # temp files (another worker's render) are left alone.
+                    if entry.name.endswith('.tmp') and st.st_mtime < stale_before:
+                        try:
+                            os.remove(entry.path)
+                        except FileNotFoundError:
+                            pass
+                    continue
+                found.append((st.st_mtime, match.group(1), st.st_size))
+        found.sort()
+        return OrderedDict((key, size) for _mtime, key, size in found)
+
+    def _install_locked(self, entries):
+        self._entries = entries
+        self._total = sum(entries.values())
+        self._loaded = True
+        self._scanned_at = time.monotonic()
+        self._stats['scans'] += 1
+
+    def _evict_locked(self, keep):
+        # ``keep`` is the entry just written; it is served right after this,
+        # even when it alone exceeds the budget. Another worker may already
+        # have evicted it, in which case a fresh scan no longer lists it.
+        if keep in self._entries:
+            self._entries.move_to_end(keep)
+        target = self.max_bytes * self.low_water
+        while self._entries and self._total > target:
+            key = next(iter(self._entries))
+            if key == keep:
+                break
+            size = self._entries.pop(key)
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+            self._total -= size
+            self._stats['evictions'] += 1
+
+    def _insert(self, key, size):
+        with self._lock:
+            self._total += size - self._entries.pop(key, 0)
+            self._entries[key] = size
+            if self._total <= self.max_bytes:
+                return
+            rescan = not self._scanning and time.monotonic() - self._scanned_at >= self.rescan_seconds
+            if not rescan:
+                self._evict_locked(keep=key)
+                return
+            self._scanning = True
+        try:
+            entries = self._scan()
+        except OSError:
+            entries = None
+        with self._lock:
+            self._scanning = False
+            if entries is not None:
+                self._install_locked(entries)
+            self._evict_locked(keep=key)
+
+    def get_or_create(self, key, render):
+        """Path of the cached file for ``key``; ``render(path)`` fills a miss and returns its size."""
+        path = self._path(key)
+        while True:
+            with self._lock:
+                if not self._loaded:
+                    self._install_locked(self._scan())
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    self._stats['hits'] += 1
+                    event = None
+                elif key in self._inflight:
+                    event = self._inflight[key]
+                    self._stats['coalesced'] += 1
+                else:
+                    event = self._inflight[key] = threading.Event()
+                    break
+            if event is not None:
+                event.wait()
+                continue
+            try:
+                os.utime(path)
+                return path
+            except FileNotFoundError:
+                # Evicted by another worker; forget it and render again.
+                with self._lock:
+                    self._total -= self._entries.pop(key, 0)
+
+        try:
+            try:
+                size = os.path.getsize(path)  # another worker already rendered it
+            except FileNotFoundError:
+                with self._lock:
+                    self._stats['misses'] += 1
+                size = render(path)
+            self._insert(key, size)
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            event.set()
+        return path
+
+    def stats(self):
+        with self._lock:
+            return dict(
+                self._stats,
+                entries=len(self._entries),
+                bytes=self._total,
+                max_bytes=self.max_bytes,
+                inflight=len(self._inflight),
+            )
+
+
+_resized_images = _ResizedImageCache(
+    os.getenv('IMAGE_CACHE_DIR', os.path.join(_data_dir, 'image-cache')),
+    max_bytes=int(float(os.getenv('IMAGE_CACHE_MAX_MB', '256')) * 1024 * 1024),
+)
+
+
+def _render_resized_image(source, width, destination):
+    img = load_image(source, max_dimension=1 << 30)
+    if width < img.width:
+        img = resize_to_width(img, width)
+    temp_path = save_webp(img, destination, IMAGE_RESIZE_QUALITY)
+    os.replace(temp_path, destination)
+    return os.path.getsize(destination)
+
+
+def resized_image_url(path, width):
+    return url_for('resized_image', width=width, filename=normalize_static_path(path))
+
+
+@app.route('/img/<int:width>/<path:filename>')
+def resized_image(width, filename):
+    from flask import send_file
+    filename = normalize_static_path(filename)
+    if width not in IMAGE_RESIZE_WIDTHS or os.path.splitext(filename)[1].lower() not in RESIZABLE_EXTENSIONS:
+        abort(404)
+    # Only files the asset manifest knows about, which also rules out traversal.
+    digest = asset_manifest.content_hash(filename)
+    if not digest:
+        abort(404)
+    key = hashlib.sha256(
+        f'{filename}|{digest}|{width}|{IMAGE_RESIZE_QUALITY}|{WEBP_METHOD}'.encode('utf-8')
+    ).hexdigest()[:32]
+    path = _resized_images.get_or_create(
+        key,
+        lambda destination: _render_resized_image(static_path_to_abspath(filename), width, destination),
+    )
+    # Immutable caching for ?v=<current hash> is added by cache_fingerprinted_static.
+    return send_file(path, mimetype='image/webp', conditional=True, etag=key)
+
+
 def get_authoritative_visit_count():
     return _read_visit_count()
 
 
 def get_authoritative_visitor_locations():
+    """One entry per mapped visit (the legacy map shape).
+
+    Expanded from the location rollup rather than read from visitor_events,
+    so visits archived by compaction stay on the map.
+    """
+    try:
+        with _visitor_db() as conn:
+            rows = conn.execute(
+                "SELECT lat, lon, city, country, count FROM visitor_location_rollup ORDER BY lat, lon"
+            ).fetchall()
+        locations = []
+        for r in rows:
+            location = {'lat': r['lat'], 'lon': r['lon'], 'city': r['city'], 'country': r['country']}
+            locations.extend(dict(location) for _ in range(r['count']))
+        return locations
+    except Exception:
+        return []
+
+
+def get_visitor_location_points():
+    """Mapped visits pre-grouped by coordinate, one entry per map pin.
+
+    When a coordinate carries several city labels, the busiest one names the pin.
+    """
     try:
-        _ensure_visitor_db()
         with _visitor_db() as conn:
             rows = conn.execute(
                 """
-                SELECT lat, lon, city, country
-                  FROM visitor_events
-                 WHERE lat IS NOT NULL AND lon IS NOT NULL
+                SELECT lat, lon, city, country, MAX(count) AS top, SUM(count) AS count
+                  FROM visitor_location_rollup
+                 GROUP BY lat, lon
                 """
             ).fetchall()
-        return [dict(r) for r in rows]
+        return [
+            {'lat': r['lat'], 'lon': r['lon'], 'city': r['city'], 'country': r['country'], 'count': r['count']}
+            for r in rows
+        ]
+    except Exception:
+        return []
+
+
+def _parse_bbox(value):
+    """Parse ``west,south,east,north`` into SQL bounds; None when absent or invalid.
+
+    Longitudes are wrapped into [-180, 180]. A box whose west edge ends up east
+    of its east edge straddles the antimeridian and is matched as two bands.
+    """
+    if not value:
+        return None
+    try:
+        west, south, east, north = (float(part) for part in value.split(','))
+    except ValueError:
+        return None
+    if not all(math.isfinite(v) for v in (west, south, east, north)):
+        return None
+    south, north = max(min(south, north), -90.0), min(max(south, north), 90.0)
+    if east - west >= 360:
+        west, east = -180.0, 180.0
+    else:
+        west = (west + 180.0) % 360.0 - 180.0
+        east = (east + 180.0) % 360.0 - 180.0
+    return west, south, east, north
+
+
+def get_visitor_location_clusters(zoom, bbox=None):
+    """Cluster rollup points into screen-space cells for a Leaflet zoom level.
+
+    Each cell is the zoom+3 tile (about 32px on screen), so the number of
+    clusters is bounded by the viewport rather than by visitor history. The
+    cluster sits at the visit-weighted centroid of its locations and is
+    labelled with its busiest one.
+    """
+    prefix = min(max(int(zoom), 0) + 3, _QUADKEY_LEVEL)
+    where, params = '', []
+    if bbox is not None:
+        west, south, east, north = bbox
+        if west <= east:
+            where = 'WHERE lat BETWEEN ? AND ? AND lon BETWEEN ? AND ?'
+            params = [south, north, west, east]
+        else:
+            where = 'WHERE lat BETWEEN ? AND ? AND (lon >= ? OR lon <= ?)'
+            params = [south, north, west, east]
+    try:
+        with _visitor_db() as conn:
+            rows = conn.execute(
+                f"""
+                SELECT substr(quadkey, 1, ?) AS cell,
+                       SUM(lat * count) / SUM(count) AS lat,
+                       SUM(lon * count) / SUM(count) AS lon,
+                       city, country, MAX(count) AS top,
+                       SUM(count) AS count,
+                       COUNT(DISTINCT printf('%.1f,%.1f', lat, lon)) AS locations
+                  FROM visitor_location_rollup
+                  {where}
+                 GROUP BY cell
+                """,
+                [prefix] + params,
+            ).fetchall()
     except Exception:
         return []
+    return [
+        {
+            'lat': round(r['lat'], 4),
+            'lon': round(r['lon'], 4),
+            'city': r['city'],
+            'country': r['country'],
+            'count': r['count'],
+            'locations': r['locations'],
+        }
+        for r in rows
+    ]
+
+
+def get_visitor_summary():
+    """Headline visitor stats from the rollup, without touching visitor_events."""
+    try:
+        with _visitor_db() as conn:
+            row = conn.execute(
+                """
+                SELECT COALESCE(SUM(count), 0) AS location_count,
+                       COUNT(DISTINCT NULLIF(country, '')) AS unique_countries
+                  FROM visitor_location_rollup
+                """
+            ).fetchone()
+        location_count, unique_countries = int(row['location_count']), int(row['unique_countries'])
+    except Exception:
+        location_count, unique_countries = 0, 0
+    return {
+        'total_visits': _read_visit_count(),
+        'unique_countries': unique_countries,
+        'location_count': location_count,
+    }
+
+
+# ============================================
+# VISITOR ANALYTICS ROLLUPS
+# ============================================
+VISITOR_STATS_DIMENSIONS = ('total', 'path', 'referrer_host', 'user_agent_family', 'country')
+VISITOR_STATS_GRANULARITIES = {'hour': 13, 'day': 10}   # prefix length of created_at
+_VISITOR_STATS_BATCH = 50000
+# Country arrives after geocoding, so events stay out of the rollup while their
+# lookup is pending -- unless they are older than this, in which case they are
+# folded in as-is rather than stalling the watermark forever.
+_VISITOR_STATS_PENDING_GRACE_SECONDS = 3600
+
+
+def refresh_visitor_stats():
+    """Fold events past the watermark into the hour/day rollups.
+
+    Work is proportional to the number of new events, capped per call at
+    ``_VISITOR_STATS_BATCH``. Returns the number of events processed.
+    """
+    cutoff = datetime.utcfromtimestamp(time.time() - _VISITOR_STATS_PENDING_GRACE_SECONDS)
+    cutoff_iso = cutoff.replace(microsecond=0).isoformat() + 'Z'
+    with _visitor_db() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            watermark = int(conn.execute("SELECT watermark FROM visitor_stats_state WHERE id = 1").fetchone()[0])
+            newest = conn.execute("SELECT MAX(sequence) FROM visitor_events").fetchone()[0]
+            if newest is None or newest <= watermark:
+                conn.rollback()
+                return 0
+            blocking = conn.execute(
+                """
+                SELECT MIN(sequence) FROM visitor_events
+                 WHERE geocode_status = 'pending' AND sequence > ? AND created_at > ?
+                """,
+                (watermark, cutoff_iso),
+            ).fetchone()[0]
+            upper = min(newest, watermark + _VISITOR_STATS_BATCH)
+            if blocking is not None:
+                upper = min(upper, blocking - 1)
+            if upper <= watermark:
+                conn.rollback()
+                return 0
+            for granularity, width in VISITOR_STATS_GRANULARITIES.items():
+                for dimension in VISITOR_STATS_DIMENSIONS:
+                    value_expr = "''" if dimension == 'total' else f"COALESCE({dimension}, '')"
+                    conn.execute(
+                        f"""
+                        INSERT INTO visitor_stats_rollup (granularity, dimension, bucket, value, count)
+                        SELECT ?, ?, substr(created_at, 1, {width}), {value_expr}, COUNT(*)
+                          FROM visitor_events
+                         WHERE sequence > ? AND sequence <= ?
+                         GROUP BY 3, 4
+                        ON CONFLICT (granularity, dimension, bucket, value)
+                        DO UPDATE SET count = count + excluded.count
+                        """,
+                        (granularity, dimension, watermark, upper),
+                    )
+            processed = conn.execute(
+                "SELECT COUNT(*) FROM visitor_events WHERE sequence > ? AND sequence <= ?",
+                (watermark, upper),
+            ).fetchone()[0]
+            conn.execute(
+                "UPDATE visitor_stats_state SET watermark = ?, updated_at = ? WHERE id = 1",
+                (upper, _utc_iso()),
+            )
+            conn.commit()
+            return processed
+        except Exception:
+            conn.rollback()
+            raise
+
+
+def _stats_bucket(value, width):
+    """Normalize a ``YYYY-MM-DD[THH...]`` bound to a bucket key of ``width`` chars."""
+    value = (value or '').strip().replace(' ', 'T')
+    if len(value) < 10:
+        return None
+    try:
+        datetime.strptime(value[:10], '%Y-%m-%d')
+    except ValueError:
+        return None
+    if width == 13:
+        hour = value[11:13] if len(value) >= 13 else '00'
+        if not hour.isdigit() or int(hour) > 23:
+            return None
+        return f'{value[:10]}T{hour}'
+    return value[:10]
+
+
+def get_visitor_stats(granularity='day', dimension='total', start=None, end=None, limit=20):
+    """Range query over the rollup: per-bucket counts plus top values for the range."""
+    width = VISITOR_STATS_GRANULARITIES[granularity]
+    if end is None:
+        end = _utc_iso()[:width]
+    if start is None:
+        span = 48 * 3600 if granularity == 'hour' else 30 * 86400
+        start = (datetime.utcnow().replace(microsecond=0) - timedelta(seconds=span)).isoformat()[:width]
+    with _visitor_db() as conn:
+        rows = conn.execute(
+            """
+            SELECT bucket, value, count
+              FROM visitor_stats_rollup
+             WHERE granularity = ? AND dimension = ? AND bucket BETWEEN ? AND ?
+             ORDER BY bucket
+            """,
+            (granularity, dimension, start, end),
+        ).fetchall()
+    buckets = OrderedDict()
+    totals = {}
+    for row in rows:
+        buckets.setdefault(row['bucket'], {})[row['value']] = row['count']
+        totals[row['value']] = totals.get(row['value'], 0) + row['count']
+    top = sorted(totals.items(), key=lambda item: (-item[1], item[0]))[:limit]
+    return {
+        'granularity': granularity,
+        'dimension': dimension,
+        'start': start,
+        'end': end,
+        'buckets': [{'bucket': bucket, 'values': values} for bucket, values in buckets.items()],
+        'totals': dict(top),
+    }
+
+
+# ============================================
+# VISITOR EVENT RETENTION
+# Events older than VISITOR_RETENTION_DAYS are appended to monthly gzip NDJSON
+# archives under $DATA_DIR/archive and removed from the live table, after the
+# analytics and location rollups have already counted them.
+# ============================================
+_visitor_archive_dir = os.path.join(_data_dir, 'archive')
+
+
+def _ensure_incremental_vacuum(conn):
+    """Switch the DB to incremental auto-vacuum; the one-off VACUUM is only paid once."""
+    if int(conn.execute("PRAGMA auto_vacuum").fetchone()[0]) != 2:
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+
+
+def _append_visitor_archive(rows, archive_dir):
+    """Append rows to per-month gzip NDJSON files and fsync before returning."""
+    by_month = {}
+    for row in rows:
+        by_month.setdefault(row['created_at'][:7], []).append(row)
+    os.makedirs(archive_dir, exist_ok=True)
+    for month, month_rows in by_month.items():
+        path = os.path.join(archive_dir, f'visitor_events-{month}.ndjson.gz')
+        # Each append is its own gzip member; gzip readers concatenate them.
+        with open(path, 'ab') as raw:
+            with gzip.GzipFile(fileobj=raw, mode='ab') as gz:
+                for row in month_rows:
+                    gz.write(json.dumps(dict(row), separators=(',', ':')).encode('utf-8') + b'\n')
+            raw.flush()
+            os.fsync(raw.fileno())
+
+
+def compact_visitor_events(retention_days, batch_size=1000, archive_dir=None):
+    """Archive and delete events older than ``retention_days``, batch by batch.
+
+    Only events already folded into the analytics rollup (at or below its
+    watermark) are eligible. Each batch is archived and fsynced before its
+    delete commits, so a crash in between can at worst archive a batch twice;
+    it never loses one. Freed pages are returned with incremental vacuum.
+    """
+    archive_dir = archive_dir or _visitor_archive_dir
+    while refresh_visitor_stats():
+        pass
+    cutoff = datetime.utcfromtimestamp(time.time() - retention_days * 86400)
+    cutoff_iso = cutoff.replace(microsecond=0).isoformat() + 'Z'
+    archived = 0
+    with _visitor_db() as conn:
+        _ensure_incremental_vacuum(conn)
+        watermark = int(conn.execute("SELECT watermark FROM visitor_stats_state WHERE id = 1").fetchone()[0])
+        while True:
+            rows = conn.execute(
+                """
+                SELECT * FROM visitor_events
+                 WHERE created_at < ? AND sequence <= ?
+                 ORDER BY created_at
+                 LIMIT ?
+                """,
+                (cutoff_iso, watermark, batch_size),
+            ).fetchall()
+            if not rows:
+                break
+            _append_visitor_archive(rows, archive_dir)
+            ids = [(row['id'],) for row in rows]
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany("DELETE FROM visitor_events WHERE id = ?", ids)
+            conn.executemany("DELETE FROM geocode_jobs WHERE event_id = ?", ids)
+            # Keeps the map's ETag (vl-<count>-<version>) honest for anything
+            # still derived from raw events.
+            conn.execute("UPDATE visitor_counter SET locations_version = locations_version + 1 WHERE id = 1")
+            conn.commit()
+            archived += len(rows)
+        freed = int(conn.execute("PRAGMA freelist_count").fetchone()[0])
+        # incremental_vacuum frees one page per step; drain it to free them all.
+        conn.execute("PRAGMA incremental_vacuum").fetchall()
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    return {'archived': archived, 'cutoff': cutoff_iso, 'pages_freed': freed}
+
+
+def _json_with_validators(etag, cache_control, build):
+    """JSON response that answers If-None-Match before any work happens.
+
+    ``etag`` must be derived from a cheap version token; ``build`` is only
+    called when the client's copy is stale.
+    """
+    from flask import request
+    if request.if_none_match.contains_weak(etag):
+        response = app.response_class(status=304)
+    else:
+        response = jsonify(build())
+    # Weak because the body bytes depend on the negotiated content-coding;
+    # the 304 repeats the validator the (possibly gzipped) 200 carries.
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = cache_control
+    return response
 
 
 def get_visitor_snapshot():
@@ -417,23 +2544,29 @@ def get_visitor_snapshot():
         'location_count': len(locations),
     }
 
-def load_projects():
-    """Load projects from JSON file"""
-    with open('static/data/projects.json', 'r') as f:
-        return json.load(f)
+_lyrics_cache = {'mtime_ns': None, 'data': []}
+_lyrics_cache_lock = threading.Lock()
 
-def get_quick_stats():
-    """Calculate quick stats for the home page"""
-    from datetime import datetime
-    projects = load_projects()
-    all_projects = projects.get('personal', []) + projects.get('academic', [])
 
-    # Count unique technologies
+def load_lyrics():
+    """Return (lyrics, version); the file is only re-parsed when its mtime changes."""
+    path = os.path.join('static', 'data', 'lyrics.json')
+    mtime_ns = os.stat(path).st_mtime_ns
+    if _lyrics_cache['mtime_ns'] != mtime_ns:
+        with _lyrics_cache_lock:
+            if _lyrics_cache['mtime_ns'] != mtime_ns:
+                with open(path, 'r') as f:
+                    _lyrics_cache['data'] = json.load(f)
+                _lyrics_cache['mtime_ns'] = mtime_ns
+    return _lyrics_cache['data'], mtime_ns
+
+
+def _project_stats_basis(all_projects):
+    """Project count, distinct tag count and earliest project date."""
     all_tags = set()
     for project in all_projects:
         all_tags.update(project.get('tags', []))
 
-    # Calculate years coding (from earliest project date)
     earliest_date = None
     for project in all_projects:
         date_str = project.get('date', '')
@@ -445,14 +2578,20 @@ def get_quick_stats():
                     earliest_date = project_date
             except:
                 pass
+    return len(all_projects), len(all_tags), earliest_date
 
+def get_quick_stats():
+    """Calculate quick stats for the home page"""
+    projects_count, tech_count, earliest_date = project_catalog.stats_basis()
+
+    # Calculate years coding (from earliest project date)
     years_coding = 0
     if earliest_date:
         years_coding = (datetime.now() - earliest_date).days // 365
 
     return {
-        'projects_count': len(all_projects),
-        'tech_count': len(all_tags),
+        'projects_count': projects_count,
+        'tech_count': tech_count,
         'years_coding': max(years_coding, 5)
     }
 
@@ -469,22 +2608,14 @@ def get_project_images(category, project_id, icon_image):
     }
     folder_name = folder_map.get(category, 'personal')
 
-    project_folder = os.path.join('static', 'images', 'projects', folder_name, project_id)
     icon_stem = os.path.splitext(icon_image)[0].lower() if icon_image else ''
 
     images = []
-    if os.path.isdir(project_folder):
-        for name in sorted(os.listdir(project_folder)):
-            filepath = os.path.join(project_folder, name)
-            if not os.path.isfile(filepath):
-                continue
-            stem, ext = os.path.splitext(name)
-            if ext.lower() not in IMAGE_EXTENSIONS:
-                continue
-            if icon_stem and stem.lower() == icon_stem:
-                continue
-            rel_path = os.path.relpath(filepath, 'static').replace('\\', '/')
-            images.append(rel_path)
+    for rel_path in asset_manifest.gallery(folder_name, project_id):
+        stem = os.path.splitext(rel_path.rsplit('/', 1)[1])[0]
+        if icon_stem and stem.lower() == icon_stem:
+            continue
+        images.append(rel_path)
 
     return dedupe_image_paths(images)
 
@@ -503,76 +2634,90 @@ def get_icon_image_path(category, project_id, icon_image):
 
     for candidate in (project_rel_path, root_rel_path):
         resolved = prefer_webp_asset(candidate)
-        if os.path.exists(static_path_to_abspath(resolved)):
+        if asset_manifest.exists(resolved):
             return resolved
 
     return prefer_webp_asset(project_rel_path)
 
 def get_featured_project():
     """Get the project marked as homeFeatured, or fall back to random featured"""
-    projects = load_projects()
-    all_projects = projects.get('personal', []) + projects.get('academic', [])
-
-    # First look for a project explicitly marked for home feature
-    home_featured = [p for p in all_projects if p.get('homeFeatured', False)]
-    if home_featured:
-        project = home_featured[0]  # Take the first one marked
-    else:
-        # Fall back to random from featured projects
-        featured = [p for p in all_projects if p.get('featured', False)]
-        if featured:
-            project = random.choice(featured)
-        elif all_projects:
-            project = random.choice(all_projects)
-        else:
-            return None
-
-    # Determine category
-    if project in projects.get('personal', []):
-        project['category'] = 'personal'
-    else:
-        project['category'] = 'academic'
-
-    # Get icon image path
-    project['iconImagePath'] = get_icon_image_path(
-        project['category'],
-        project['id'],
-        project.get('iconImage', '')
-    )
-    return project
+    return project_catalog.featured()
 
 def get_project_by_id(project_id):
     """Get a single project by ID with all images"""
-    projects = load_projects()
-    for category in ['personal', 'academic']:
-        for project in projects.get(category, []):
-            if project.get('id') == project_id:
-                project['category'] = category
-                # Get icon image path
-                project['iconImagePath'] = get_icon_image_path(
-                    category,
-                    project_id,
-                    project.get('iconImage', '')
-                )
-                # Get gallery images from project folder
-                project['galleryImages'] = get_project_images(
-                    category,
-                    project_id,
-                    project.get('iconImage', '')
-                )
-                return project
-    return None
+    return project_catalog.get(project_id)
 
-def enrich_project_list(projects, category):
-    """Add icon image paths to a list of projects"""
-    for project in projects:
-        project['category'] = category
-        project['iconImagePath'] = get_icon_image_path(
-            category,
-            project['id'],
-            project.get('iconImage', '')
-        )
-    return projects
+class ProjectRecord:
+    """Read-only projects.json entry with its derived fields resolved once.
+
+    Records are built when the catalog loads and then shared by every request
+    and thread, so they refuse mutation; list fields are stored as tuples.
+    Attribute access matches what templates did on the old dicts, and
+    ``get``/``[]`` keep dict-style callers working. Keys outside ``FIELDS``
+    are kept in ``extra``.
+    """
+
+    FIELDS = (
+        'id', 'title', 'shortDescription', 'description', 'iconImage', 'tags',
+        'hasGithub', 'githubLink', 'hasLive', 'liveLink', 'hasVideo', 'videoLink',
+        'hasDownload', 'downloadLink', 'featured', 'homeFeatured', 'date', 'rank',
+        'subcategory', 'university', 'lichessUser',
+    )
+    DERIVED = ('category', 'iconImagePath', 'galleryImages')
+
+    __slots__ = FIELDS + DERIVED + ('extra',)
+
+    def __init__(self, raw, category, icon_image_path, gallery_images=()):
+        setter = object.__setattr__
+        for key in self.FIELDS:
+            value = raw.get(key)
+            setter(self, key, tuple(value) if isinstance(value, list) else value)
+        setter(self, 'category', category)
+        setter(self, 'iconImagePath', icon_image_path)
+        setter(self, 'galleryImages', tuple(gallery_images))
+        setter(self, 'extra', MappingProxyType(
+            {k: v for k, v in raw.items() if k not in self.FIELDS}
+        ))
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f'{type(self).__name__} is read-only')
+
+    def __delattr__(self, name):
+        raise AttributeError(f'{type(self).__name__} is read-only')
+
+    def __getattr__(self, name):
+        # Only reached for names that are not slots.
+        try:
+            return self.extra[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def __getitem__(self, key):
+        try:
+            value = getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def get(self, key, default=None):
+        value = getattr(self, key, None)
+        return default if value is None else value
+
+    def __repr__(self):
+        return f'<ProjectRecord {self.category}/{self.id}>'
+
+
+def build_project_record(project, category):
+    """Resolve a raw project's image paths and freeze it into a ProjectRecord."""
+    icon_image = project.get('iconImage', '')
+    return ProjectRecord(
+        project,
+        category,
+        get_icon_image_path(category, project['id'], icon_image),
+        get_project_images(category, project['id'], icon_image),
+    )
 
 def group_personal_projects(projects):
     """Group personal projects by subcategory and sort by rank"""
@@ -634,9 +2779,271 @@ def group_academic_projects(projects):
 
     return result
 
+def _freeze_groups(groups):
+    return tuple((name, tuple(projects)) for name, projects in groups)
+
+
+class ProjectCatalog:
+    """projects.json parsed once and re-parsed only when its mtime changes.
+
+    Each load builds every derived view up front -- enriched project copies,
+    an id index, the grouped listing pages, quick-stat inputs and the terminal
+    payload -- and swaps them in as one immutable snapshot, so request
+    handlers only do dictionary lookups. The file is stat'ed at most once per
+    ``check_interval`` seconds. A reload that fails to parse keeps serving the
+    last good snapshot.
+
+    Records also embed image paths resolved from the asset manifest, so a
+    change of ``assets_version()`` rebuilds the snapshot from the already
+    parsed file.
+    """
+
+    CATEGORIES = ('personal', 'academic')
+
+    def __init__(self, path, check_interval=1.0, assets_version=None):
+        self.path = path
+        self.check_interval = check_interval
+        self.assets_version = assets_version or (lambda: None)
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._raw = None
+        self._mtime_ns = None
+        self._assets_version = None
+        self._checked_at = 0.0
+        self._stats = {'loads': 0, 'failed_loads': 0, 'asset_rebuilds': 0}
+
+    def _build(self, raw):
+        by_category = {}
+        by_id = {}
+        for category in self.CATEGORIES:
+            enriched = []
+            for project in raw.get(category, []):
+                if not project.get('id'):
+                    continue
+                item = build_project_record(project, category)
+                enriched.append(item)
+                by_id.setdefault(item.id, item)
+            by_category[category] = tuple(enriched)
+
+        all_projects = by_category['personal'] + by_category['academic']
+        return {
+            'by_id': by_id,
+            'by_category': by_category,
+            'grouped': {
+                'personal': _freeze_groups(group_personal_projects(by_category['personal'])),
+                'academic': _freeze_groups(group_academic_projects(by_category['academic'])),
+            },
+            'home_featured': next((p for p in all_projects if p.get('homeFeatured', False)), None),
+            'featured_pool': tuple(p for p in all_projects if p.get('featured', False)) or all_projects,
+            'stats_basis': _project_stats_basis(raw.get('personal', []) + raw.get('academic', [])),
+            'terminal': {
+                category: [_terminal_project_shape(p) for p in raw.get(category, []) if p.get('id')]
+                for category in self.CATEGORIES
+            },
+        }
+
+    def _current(self):
+        now = time.monotonic()
+        snapshot = self._snapshot
+        if snapshot is not None and now - self._checked_at < self.check_interval:
+            return snapshot
+        with self._lock:
+            if self._snapshot is not None and now - self._checked_at < self.check_interval:
+                return self._snapshot
+            try:
+                mtime_ns = os.stat(self.path).st_mtime_ns
+            except OSError:
+                if self._snapshot is None:
+                    raise
+                mtime_ns = self._mtime_ns
+            assets_version = self.assets_version()
+            if self._snapshot is None or mtime_ns != self._mtime_ns:
+                try:
+                    with open(self.path, 'r') as f:
+                        raw = json.load(f)
+                    self._snapshot = self._build(raw)
+                    self._raw = raw
+                    self._stats['loads'] += 1
+                except (OSError, ValueError):
+                    self._stats['failed_loads'] += 1
+                    if self._snapshot is None:
+                        raise
+                    if assets_version != self._assets_version:
+                        self._snapshot = self._build(self._raw)
+                self._mtime_ns = mtime_ns
+            elif assets_version != self._assets_version:
+                self._snapshot = self._build(self._raw)
+                self._stats['asset_rebuilds'] += 1
+            self._assets_version = assets_version
+            self._checked_at = now
+            return self._snapshot
+
+    @property
+    def version(self):
+        """Changes whenever the snapshot is rebuilt (new projects.json or assets)."""
+        self._current()
+        return (self._mtime_ns, self._assets_version)
+
+    def get(self, project_id):
+        return self._current()['by_id'].get(project_id)
+
+    def projects(self, category):
+        return self._current()['by_category'].get(category, ())
+
+    def grouped(self, category):
+        return self._current()['grouped'].get(category, ())
+
+    def featured(self):
+        snapshot = self._current()
+        if snapshot['home_featured'] is not None:
+            return snapshot['home_featured']
+        pool = snapshot['featured_pool']
+        return random.choice(pool) if pool else None
+
+    def stats_basis(self):
+        return self._current()['stats_basis']
+
+    def terminal_payload(self):
+        return self._current()['terminal']
+
+    def stats(self):
+        return dict(self._stats, version=self._mtime_ns, assets_version=self._assets_version)
+
+
+project_catalog = ProjectCatalog(
+    os.path.join('static', 'data', 'projects.json'),
+    assets_version=lambda: asset_manifest.version,
+)
+
+
+# ============================================
+# RENDERED PAGE CACHE
+# Catalog pages only change with projects.json, lyrics.json or the static
+# assets, so their HTML is cached per (view, arguments, data version). The
+# one per-request value, the visit counter, is rendered as a token and
+# spliced in on the way out. Stale versions simply stop being looked up and
+# age out of the LRU.
+# ============================================
+_VISIT_COUNT_TOKEN = f'__visit_count_{secrets.token_hex(8)}__'
+
+
+class _LateBoundVisitCount:
+    """Stands in for visit_count while a page is rendered for the cache."""
+
+    def __format__(self, spec):
+        return _VISIT_COUNT_TOKEN
+
+    def __str__(self):
+        return _VISIT_COUNT_TOKEN
+
+
+class _PageCache:
+    """LRU of rendered pages stored as (status, parts split on the counter token,
+    gzip segments of those parts or None)."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+            return entry
+
+    def store(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, entries=len(self._entries), max_entries=self.max_entries)
+
+
+_page_cache = _PageCache(int(os.getenv('PAGE_CACHE_SIZE', '128')))
+
+
+def _site_data_version():
+    """Inputs every page shares: the project catalog (terminal payload) and asset URLs."""
+    return (project_catalog.version, asset_manifest.version)
+
+
+def cached_page(vary=None):
+    """Serve a view's HTML from _page_cache; ``vary()`` adds view-specific key parts."""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(**kwargs):
+            from flask import g, request
+            if not _page_cache.enabled:
+                return view(**kwargs)
+            key = (
+                view.__name__,
+                tuple(sorted(kwargs.items())),
+                _site_data_version(),
+                vary() if vary else None,
+            )
+            entry = _page_cache.get(key)
+            if entry is None:
+                g.late_bound_visit_count = True
+                try:
+                    rv = view(**kwargs)
+                finally:
+                    g.late_bound_visit_count = False
+                body, status = rv if isinstance(rv, tuple) else (rv, 200)
+                parts = tuple(body.split(_VISIT_COUNT_TOKEN))
+                # Compressed once here; a gzip hit only compresses the counter
+                # (gzip_dynamic_response leaves already-encoded responses alone).
+                segments = gzip_splice_segments(parts) if status == 200 and len(body) >= GZIP_MIN_BYTES else None
+                entry = (status, parts, segments)
+                _page_cache.store(key, entry)
+            status, parts, segments = entry
+            count = f'{get_authoritative_visit_count():,}' if len(parts) > 1 else ''
+            if segments is not None and request.accept_encodings['gzip'] > 0:
+                response = app.response_class(gzip_splice(segments, count), status, mimetype='text/html')
+                response.headers['Content-Encoding'] = 'gzip'
+                response.vary.add('Accept-Encoding')
+                return response
+            return count.join(parts), status
+        return wrapper
+    return decorator
+
+
+def _home_featured_project():
+    """One featured pick per request, shared by the cache key and the view."""
+    from flask import g
+    if 'featured_project' not in g:
+        g.featured_project = get_featured_project()
+    return g.featured_project
+
+
+def _home_page_vary():
+    featured = _home_featured_project()
+    # years_coding is derived from today's date.
+    return (featured.id if featured else None, datetime.now().date().isoformat())
+
+
 @app.route('/')
+@cached_page(vary=_home_page_vary)
 def index():
-    featured = get_featured_project()
+    featured = _home_featured_project()
     stats = get_quick_stats()
     return render_template('index.html',
                          featured_project=featured,
@@ -645,32 +3052,32 @@ def index():
                          page_id='home-page')
 
 @app.route('/about')
+@cached_page()
 def about():
     return render_template('about.html',
                          active_page='about',
                          page_id='about-page')
 
 @app.route('/projects/personal')
+@cached_page()
 def personal_projects():
-    projects = load_projects()
-    personal = enrich_project_list(projects.get('personal', []), 'personal')
-    grouped = group_personal_projects(personal)
+    grouped = project_catalog.grouped('personal')
     return render_template('projects/personal.html',
                          grouped_projects=grouped,
                          active_page='personal',
                          page_id='personal-projects-page')
 
 @app.route('/projects/academic')
+@cached_page()
 def academic_projects():
-    projects = load_projects()
-    academic = enrich_project_list(projects.get('academic', []), 'academic')
-    grouped = group_academic_projects(academic)
+    grouped = project_catalog.grouped('academic')
     return render_template('projects/academic.html',
                          grouped_projects=grouped,
                          active_page='academic',
                          page_id='academic-projects-page')
 
 @app.route('/projects/<project_id>')
+@cached_page()
 def project_detail(project_id):
     project = get_project_by_id(project_id)
     if not project:
@@ -685,61 +3092,158 @@ def project_detail(project_id):
 
 @app.route('/api/lyrics/random')
 def random_lyric():
-    """Get a random lyric for the footer"""
+    """Get a random lyric for the footer.
+
+    The pick is random, so responses are never cached; each lyric still gets a
+    stable ETag so a client re-sent the same one gets a 304.
+    """
     try:
-        with open('static/data/lyrics.json', 'r') as f:
-            lyrics_data = json.load(f)
+        lyrics_data, version = load_lyrics()
         if lyrics_data:
-            lyric = random.choice(lyrics_data)
-            return jsonify(lyric)
+            index = random.randrange(len(lyrics_data))
+            return _json_with_validators(
+                f'lyric-{version}-{index}', 'no-cache', lambda: lyrics_data[index]
+            )
         return jsonify({"error": "No lyrics available"}), 500
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 @app.route('/api/visit', methods=['POST'])
 def record_visit():
-    """Record one visit. Bots are filtered by user-agent and not counted."""
+    """Record one visit. Bots are filtered by user-agent and not counted.
+
+    Repeat visits from the same client inside the de-dupe window are answered
+    from memory without touching SQLite.
+    """
     if _is_likely_bot():
         return jsonify({'count': _read_visit_count(), 'counted': False})
+    if not _visit_limiter.allow(get_real_ip(), _ua_family()):
+        return jsonify({'count': _read_visit_count(), 'counted': False, 'duplicate': True})
     count = _record_visit_event()
     return jsonify({'count': count, 'counted': True})
 
 
 @app.route('/api/visit-count')
 def get_visit_count_route():
-    return jsonify({'count': _read_visit_count()})
+    count = _read_visit_count()
+    return _json_with_validators(f'vc-{count}', 'no-cache', lambda: {'count': count})
 
 
-@app.route('/api/reset-visitors', methods=['POST'])
-def reset_visitors():
-    """Reset visit counter and visitor events. Requires ADMIN_KEY header."""
+def _is_admin_request():
     from flask import request
     admin_key = os.getenv('ADMIN_KEY', '')
     provided = request.headers.get('X-Admin-Key', '')
-    if not admin_key or provided != admin_key:
+    return bool(admin_key) and secrets.compare_digest(provided, admin_key)
+
+
+def get_runtime_stats():
+    """Process-local counters for the visitor pipeline, keyed by subsystem."""
+    return {
+        'pid': os.getpid(),
+        'visitor_db_pool': _visitor_pool.stats(),
+        'visit_count_cache': _visit_count_cache.stats(),
+        'geocoder': _geocoder.stats(),
+        'geo_cache': _geo_cache.stats(),
+        'visit_limiter': _visit_limiter.stats(),
+        'visit_group_commit': _visit_group_commit.stats() if _visit_group_commit is not None else None,
+        'ua_classifier': classifier_stats(),
+        'project_catalog': project_catalog.stats(),
+        'asset_manifest': asset_manifest.stats(),
+        'resized_images': _resized_images.stats(),
+        'page_cache': _page_cache.stats(),
+        'offline_geo': _offline_geo.stats() if _offline_geo is not None else None,
+    }
+
+
+@app.route('/api/runtime-stats')
+def runtime_stats():
+    """Internal pool/queue stats for this worker. Requires ADMIN_KEY header."""
+    if not _is_admin_request():
+        return jsonify({'error': 'unauthorized'}), 401
+    return jsonify(get_runtime_stats())
+
+
+@app.route('/api/visitor-stats')
+def visitor_stats_api():
+    """Visits per hour/day by path, referrer, UA family or country. Requires ADMIN_KEY header.
+
+    Query: ``granularity`` (hour|day), ``dimension`` (total|path|referrer_host|
+    user_agent_family|country), ``start``/``end`` (YYYY-MM-DD or YYYY-MM-DDTHH,
+    inclusive) and ``limit`` for the number of top values in ``totals``.
+    """
+    from flask import request
+    if not _is_admin_request():
+        return jsonify({'error': 'unauthorized'}), 401
+    granularity = request.args.get('granularity', 'day')
+    dimension = request.args.get('dimension', 'total')
+    if granularity not in VISITOR_STATS_GRANULARITIES or dimension not in VISITOR_STATS_DIMENSIONS:
+        return jsonify({'error': 'bad granularity or dimension'}), 400
+    width = VISITOR_STATS_GRANULARITIES[granularity]
+    start = end = None
+    if request.args.get('start'):
+        start = _stats_bucket(request.args['start'], width)
+    if request.args.get('end'):
+        end = _stats_bucket(request.args['end'], width)
+    if (request.args.get('start') and start is None) or (request.args.get('end') and end is None):
+        return jsonify({'error': 'bad start or end'}), 400
+    limit = min(max(request.args.get('limit', 20, type=int), 1), 500)
+    refresh_visitor_stats()
+    return jsonify(get_visitor_stats(granularity, dimension, start, end, limit))
+
+
+@app.route('/api/reset-visitors', methods=['POST'])
+def reset_visitors():
+    """Reset visit counter and visitor events. Requires ADMIN_KEY header."""
+    if not _is_admin_request():
         return jsonify({'error': 'unauthorized'}), 401
-    _ensure_visitor_db()
     now = _utc_iso()
-    with _visit_lock:
-        with _visitor_db() as conn:
-            conn.execute("DELETE FROM visitor_events")
-            conn.execute(
-                "UPDATE visitor_counter SET count = 0, updated_at = ? WHERE id = 1",
-                (now,),
-            )
-            conn.commit()
-        _write_visit_count_mirror(0)
+    with _visitor_db() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("DELETE FROM visitor_events")
+        conn.execute("DELETE FROM geocode_jobs")
+        conn.execute("DELETE FROM visitor_location_rollup")
+        conn.execute("DELETE FROM visitor_stats_rollup")
+        conn.execute("UPDATE visitor_stats_state SET watermark = 0, updated_at = ? WHERE id = 1", (now,))
+        conn.execute(
+            "UPDATE visitor_counter SET count = 0, locations_version = locations_version + 1, updated_at = ? WHERE id = 1",
+            (now,),
+        )
+        conn.commit()
+    _write_visit_count_mirror(0, reset=True)
+    _visit_count_cache.store(0, reset=True)
     return jsonify({'status': 'reset', 'visits': 0, 'locations': 0})
 
 
 @app.route('/api/visitor-locations')
 def visitor_locations_api():
-    """Return all visitor locations for the map"""
-    return jsonify(get_visitor_snapshot())
+    """Return visitor locations for the map.
+
+    ``?mode=grouped`` returns one point per coordinate with its visit count plus
+    precomputed totals, so the payload grows with distinct locations rather
+    than with visits. Adding ``zoom`` (and optionally ``bbox=west,south,east,north``)
+    returns clusters for that view instead. Without ``mode``, the legacy
+    one-row-per-visit shape is kept.
+    """
+    from flask import request
+    count, locations_version = _visit_count_cache.snapshot()
+    etag = f'vl-{count}-{locations_version}'
+    cache_control = 'public, max-age=30'
+    if request.args.get('mode') == 'grouped':
+        zoom = request.args.get('zoom', type=int)
+
+        def build():
+            if zoom is None:
+                points = get_visitor_location_points()
+            else:
+                points = get_visitor_location_clusters(zoom, _parse_bbox(request.args.get('bbox')))
+            return dict(get_visitor_summary(), points=points, point_count=len(points))
+
+        return _json_with_validators(etag, cache_control, build)
+    return _json_with_validators(etag, cache_control, get_visitor_snapshot)
 
 @app.route('/visitors')
 def visitors():
-    visitor_snapshot = get_visitor_snapshot()
+    visitor_snapshot = get_visitor_summary()
     return render_template('visitors.html',
                          active_page='visitors',
                          page_id='visitors-page',
@@ -748,9 +3252,9 @@ def visitors():
                          location_count=visitor_snapshot['location_count'])
 
 @app.route('/lyrics')
+@cached_page(vary=lambda: load_lyrics()[1])
 def all_lyrics():
-    with open('static/data/lyrics.json', 'r') as f:
-        lyrics_data = json.load(f)
+    lyrics_data, _version = load_lyrics()
     return render_template('lyrics/all.html',
                          lyrics=lyrics_data,
                          active_page='lyrics',
@@ -766,6 +3270,158 @@ def page_not_found(e):
     return render_template('404.html',
                          page_id='error-page'), 404
 
+# ============================================
+# STATIC EXPORT
+# `flask --app app export-site OUT` renders every HTML route to OUT/<path>/
+# index.html (plus OUT/404.html) and mirrors static/ to OUT/static, so a CDN
+# or nginx can serve pages while /api/*, /visitors and /img keep running on
+# Flask. Each page records what it was built from -- the data files it
+# reads, the static assets its HTML references, templates and code -- and is
+# only re-rendered when one of those changes.
+# ============================================
+EXPORT_STATE_FILE = '.export-manifest.json'
+EXPORT_NOT_FOUND_PROBE = '/__export-not-found__'
+_STATIC_REF_RE = re.compile(r'/static/([^"\'?#\s)]+)')
+
+
+def _export_routes():
+    """(url, output file, data files read) for every prerenderable page."""
+    routes = [
+        ('/', 'index.html', ['data/projects.json']),
+        ('/about', 'about/index.html', ['data/projects.json']),
+        ('/projects/personal', 'projects/personal/index.html', ['data/projects.json']),
+        ('/projects/academic', 'projects/academic/index.html', ['data/projects.json']),
+    ]
+    for category in ProjectCatalog.CATEGORIES:
+        for project in project_catalog.projects(category):
+            routes.append((f'/projects/{project.id}', f'projects/{project.id}/index.html', ['data/projects.json']))
+    routes += [
+        ('/lyrics', 'lyrics/index.html', ['data/projects.json', 'data/lyrics.json']),
+        ('/all-lyrics', 'all-lyrics/index.html', ['data/projects.json', 'data/lyrics.json']),
+        (EXPORT_NOT_FOUND_PROBE, '404.html', ['data/projects.json']),
+    ]
+    return routes
+
+
+def _export_code_digest():
+    """Templates and the modules that render them; any edit re-renders every page."""
+    digest = hashlib.sha256()
+    paths = ['app.py', 'static_assets.py']
+    for dirpath, _dirnames, filenames in os.walk(app.template_folder):
+        paths.extend(os.path.join(dirpath, name) for name in filenames)
+    for path in sorted(paths):
+        digest.update(path.encode('utf-8'))
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+
+def _export_fingerprint(code_digest, url, deps):
+    parts = [code_digest, url]
+    if url == '/':
+        parts.append(datetime.now().date().isoformat())  # years_coding
+    parts.extend(
+        f'{dep}={asset_manifest.tree_hash(dep) if dep.endswith("/") else asset_manifest.content_hash(dep)}'
+        for dep in sorted(deps)
+    )
+    return hashlib.sha256('|'.join(parts).encode('utf-8')).hexdigest()[:16]
+
+
+def _export_static_path(path):
+    """Vendored bundles are exported under their versioned directory, as pages link them."""
+    parts = path.split('/')
+    if len(parts) > 2 and parts[0] == 'vendor':
+        version = asset_manifest.tree_hash(f'vendor/{parts[1]}')
+        return '/'.join(['vendor', f'{parts[1]}~{version}', *parts[2:]])
+    return path
+
+
+def _export_static(output_dir):
+    """Mirror manifest-known assets and their precompressed siblings; returns files copied."""
+    import shutil
+    copied = 0
+    for rel in asset_manifest.paths():
+        for path in [rel, *(asset_manifest.encodings(rel) or {}).values()]:
+            source = static_path_to_abspath(path)
+            target = os.path.join(output_dir, 'static', *_export_static_path(path).split('/'))
+            try:
+                st = os.stat(target)
+                src = os.stat(source)
+                if st.st_size == src.st_size and st.st_mtime_ns == src.st_mtime_ns:
+                    continue
+            except FileNotFoundError:
+                pass
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.copy2(source, target)
+            copied += 1
+    return copied
+
+
+def export_site(output_dir, force=False):
+    """Prerender every page into ``output_dir``; returns counts of what changed."""
+    state_path = os.path.join(output_dir, EXPORT_STATE_FILE)
+    try:
+        with open(state_path, 'r') as f:
+            previous = json.load(f).get('pages', {})
+    except (OSError, ValueError):
+        previous = {}
+
+    code_digest = _export_code_digest()
+    client = app.test_client()
+    pages = {}
+    result = {'rendered': 0, 'unchanged': 0, 'removed': 0}
+    for url, rel_file, data_deps in _export_routes():
+        target = os.path.join(output_dir, *rel_file.split('/'))
+        entry = previous.get(url)
+        if (
+            not force
+            and entry is not None
+            and entry.get('file') == rel_file
+            and os.path.exists(target)
+            and entry.get('fingerprint') == _export_fingerprint(code_digest, url, entry.get('deps', []))
+        ):
+            pages[url] = entry
+            result['unchanged'] += 1
+            continue
+
+        response = client.get(url)
+        expected = 404 if url == EXPORT_NOT_FOUND_PROBE else 200
+        if response.status_code != expected:
+            raise RuntimeError(f'{url} returned {response.status_code}, expected {expected}')
+        html = response.get_data()
+        assets = set()
+        for ref in map(urllib.parse.unquote, _STATIC_REF_RE.findall(html.decode('utf-8'))):
+            ref, package, _version = split_vendor_version(ref)
+            if package is not None:
+                assets.add(f'{package}/')
+            elif asset_manifest.content_hash(ref):
+                assets.add(ref)
+        deps = sorted(set(data_deps) | assets)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        temp_path = f'{target}.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(html)
+        os.replace(temp_path, target)
+        pages[url] = {
+            'file': rel_file,
+            'deps': deps,
+            'fingerprint': _export_fingerprint(code_digest, url, deps),
+        }
+        result['rendered'] += 1
+
+    for url, entry in previous.items():
+        if url not in pages and entry.get('file') not in {p['file'] for p in pages.values()}:
+            try:
+                os.remove(os.path.join(output_dir, *entry['file'].split('/')))
+                result['removed'] += 1
+            except (OSError, KeyError):
+                pass
+
+    result['static_copied'] = _export_static(output_dir)
+    with open(state_path, 'w') as f:
+        json.dump({'pages': pages}, f, indent=1, sort_keys=True)
+    return result
+
 if __name__ == '__main__':
     port = int(os.getenv("PORT", 5000))
     app.run(debug=False, host='0.0.0.0', port=port)
@@ -0,0 +1,126 @@
+from __future__ import annotations
+
+import argparse
+import random
+import re
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from ua_classifier import classifier_stats, classify_user_agent  # noqa: E402
+
+
+# A mix of current desktop/mobile browsers, in-app webviews and crawlers as
+# they show up in access logs.
+UA_CORPUS = (
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36',
+    'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36',
+    'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/123.0.0.0 Safari/537.36',
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36 Edg/124.0.2478.51',
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:125.0) Gecko/20100101 Firefox/125.0',
+    'Mozilla/5.0 (Macintosh; Intel Mac OS X 14.4; rv:125.0) Gecko/20100101 Firefox/125.0',
+    'Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:124.0) Gecko/20100101 Firefox/124.0',
+    'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.4.1 Safari/605.1.15',
+    'Mozilla/5.0 (iPhone; CPU iPhone OS 17_4_1 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.4.1 Mobile/15E148 Safari/604.1',
+    'Mozilla/5.0 (iPad; CPU OS 17_4 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.4 Mobile/15E148 Safari/604.1',
+    'Mozilla/5.0 (iPhone; CPU iPhone OS 17_4 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Mobile/15E148 Instagram 327.0.0.32.95',
+    'Mozilla/5.0 (iPhone; CPU iPhone OS 17_3 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Mobile/15E148 [LinkedInApp]',
+    'Mozilla/5.0 (Linux; Android 14; Pixel 8) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.6367.82 Mobile Safari/537.36',
+    'Mozilla/5.0 (Linux; Android 13; SM-S918B) AppleWebKit/537.36 (KHTML, like Gecko) SamsungBrowser/24.0 Chrome/117.0.0.0 Mobile Safari/537.36',
+    'Mozilla/5.0 (Android 14; Mobile; rv:125.0) Gecko/125.0 Firefox/125.0',
+    'Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)',
+    'Mozilla/5.0 (Linux; Android 6.0.1; Nexus 5X Build/MMB29P) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.6367.91 Mobile Safari/537.36 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)',
+    'Mozilla/5.0 (compatible; bingbot/2.0; +http://www.bing.com/bingbot.htm)',
+    'Mozilla/5.0 (compatible; Yahoo! Slurp; http://help.yahoo.com/help/us/ysearch/slurp)',
+    'facebookexternalhit/1.1 (+http://www.facebook.com/externalhit_uatext.php)',
+    'Twitterbot/1.0',
+    'Slackbot-LinkExpanding 1.0 (+https://api.slack.com/robots)',
+    'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_10_1) AppleWebKit/600.2.5 (KHTML, like Gecko) Version/8.0.2 Safari/600.2.5 (Applebot/0.1)',
+    'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) HeadlessChrome/124.0.0.0 Safari/537.36',
+    'Mozilla/5.0 (compatible; UptimeRobot/2.0; http://www.uptimerobot.com/)',
+    'Mozilla/5.0 (compatible; AhrefsBot/7.0; +http://ahrefs.com/robot/)',
+    'Mozilla/5.0 (compatible; SemrushBot/7~bl; +http://www.semrush.com/bot.html)',
+    'Mozilla/5.0 (compatible; Discordbot/2.0; +https://discordapp.com)',
+    'WhatsApp/2.23.20.0',
+    'curl/8.4.0',
+    'python-requests/2.31.0',
+    '',
+)
+
+# The classifier this module replaced, kept here as the benchmark baseline.
+_LEGACY_BOT_RE = re.compile(
+    r'(bot|crawl|spider|slurp|facebookexternalhit|preview|scanner|uptime|monitor|headless)',
+    re.IGNORECASE,
+)
+_LEGACY_CHECKS = (
+    ('mobile_safari', 'Mobile', 'Safari'),
+    ('ios_webview', 'iPhone', 'AppleWebKit'),
+    ('chrome', 'Chrome'),
+    ('firefox', 'Firefox'),
+    ('safari', 'Safari'),
+    ('edge', 'Edg/'),
+)
+
+
+def legacy_classify(ua: str) -> tuple[bool, str]:
+    is_bot = bool(_LEGACY_BOT_RE.search(ua))
+    if not ua:
+        return is_bot, 'unknown'
+    for label, *needles in _LEGACY_CHECKS:
+        if all(n in ua for n in needles):
+            return is_bot, label
+    return is_bot, 'browser'
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description='Micro-benchmark the memoized UA classifier against the old two-pass checks.'
+    )
+    parser.add_argument(
+        '--iterations',
+        type=int,
+        default=200_000,
+        help='Classifications per variant. Default: 200000',
+    )
+    parser.add_argument(
+        '--seed',
+        type=int,
+        default=7,
+        help='Random seed for the request stream. Default: 7',
+    )
+    return parser.parse_args()
+
+
+def run(label: str, fn, stream: list[str]) -> float:
+    start = time.perf_counter()
+    for ua in stream:
+        fn(ua)
+    elapsed = time.perf_counter() - start
+    print(f'{label:<18} {elapsed * 1e9 / len(stream):8.1f} ns/call')
+    return elapsed
+
+
+def main() -> int:
+    args = parse_args()
+    mismatches = [ua for ua in UA_CORPUS if legacy_classify(ua) != classify_user_agent(ua)]
+    if mismatches:
+        for ua in mismatches:
+            print(f'MISMATCH {ua!r}: legacy={legacy_classify(ua)} new={classify_user_agent(ua)}')
+        return 1
+
+    rng = random.Random(args.seed)
+    stream = [rng.choice(UA_CORPUS) for _ in range(args.iterations)]
+
+    legacy = run('legacy two-pass', legacy_classify, stream)
+    run('single-pass cold', classify_user_agent.__wrapped__, stream)
+    classify_user_agent.cache_clear()
+    cached = run('single-pass cached', classify_user_agent, stream)
+    print(f'Speedup (cached vs legacy): {legacy / cached:.1f}x')
+    print(f'Cache stats: {classifier_stats()}')
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
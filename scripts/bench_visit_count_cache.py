@@ -0,0 +1,95 @@
+from __future__ import annotations
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description='Compare page render latency with and without the in-memory visit counter cache.'
+    )
+    parser.add_argument(
+        '--path',
+        default='/about',
+        help='Route to render. Default: /about',
+    )
+    parser.add_argument(
+        '--requests',
+        type=int,
+        default=500,
+        help='Timed requests per mode. Default: 500',
+    )
+    parser.add_argument(
+        '--warmup',
+        type=int,
+        default=50,
+        help='Untimed requests per mode before measuring. Default: 50',
+    )
+    parser.add_argument(
+        '--data-dir',
+        default=None,
+        help='DATA_DIR to benchmark against. Default: a fresh temporary directory',
+    )
+    return parser.parse_args()
+
+
+def load_app(data_dir: str):
+    os.environ['DATA_DIR'] = data_dir
+    os.chdir(REPO_ROOT)
+    sys.path.insert(0, str(REPO_ROOT))
+    import app as site
+
+    return site
+
+
+def time_requests(client, path: str, count: int) -> list[float]:
+    samples = []
+    for _ in range(count):
+        start = time.perf_counter()
+        response = client.get(path)
+        samples.append(time.perf_counter() - start)
+        if response.status_code != 200:
+            raise SystemExit(f'{path} returned {response.status_code}')
+    return samples
+
+
+def summarize(label: str, samples: list[float]) -> float:
+    ordered = sorted(samples)
+    p50 = statistics.median(ordered) * 1000
+    p95 = ordered[int(len(ordered) * 0.95) - 1] * 1000
+    mean = statistics.fmean(ordered) * 1000
+    print(f'{label:<10} mean {mean:7.3f} ms | p50 {p50:7.3f} ms | p95 {p95:7.3f} ms')
+    return mean
+
+
+def main() -> int:
+    args = parse_args()
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix='visit-cache-bench-')
+    site = load_app(data_dir)
+    client = site.app.test_client()
+    cache = site._visit_count_cache
+    if cache.ttl <= 0:
+        cache.ttl = 1.0
+
+    results = {}
+    for label, enabled in (('uncached', False), ('cached', True)):
+        cache.enabled = enabled
+        time_requests(client, args.path, args.warmup)
+        results[label] = summarize(label, time_requests(client, args.path, args.requests))
+
+    if results['cached'] > 0:
+        print(f'Speedup: {results["uncached"] / results["cached"]:.2f}x on {args.path}')
+    print(f'Cache stats: {cache.stats()}')
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
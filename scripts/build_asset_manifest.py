@@ -0,0 +1,44 @@
+from __future__ import annotations
+
+import argparse
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from static_assets import StaticAssetManifest  # noqa: E402
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description='Index every file under static/ and write the asset manifest the app loads at startup.'
+    )
+    parser.add_argument(
+        '--root',
+        default='static',
+        help='Static directory to index. Default: static',
+    )
+    parser.add_argument(
+        '--output',
+        default='asset-manifest.json',
+        help='Manifest path (match ASSET_MANIFEST_FILE). Default: asset-manifest.json',
+    )
+    return parser.parse_args()
+
+
+def main() -> int:
+    args = parse_args()
+    root = Path(args.root)
+    if not root.exists():
+        print(f'Root does not exist: {root}')
+        return 1
+
+    manifest = StaticAssetManifest(str(root), manifest_path=args.output).load()
+    manifest.write()
+    stats = manifest.stats()
+    print(f"Indexed {stats['files']} files ({stats['reused_entries']} unchanged) -> {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -1,14 +1,31 @@
 from __future__ import annotations
 
 import argparse
+import json
 import os
-import tempfile
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 
-from PIL import Image, ImageOps
+from PIL import Image
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from static_assets import (  # noqa: E402
+    VARIANTS_FILE,
+    WEBP_METHOD,
+    content_hash,
+    load_image,
+    resize_to_width,
+    save_webp,
+    variant_path,
+)
 
 
 SOURCE_EXTENSIONS = {'.jpg', '.jpeg', '.png'}
+DEFAULT_WIDTHS = '320,640,1280'
+BUILD_MANIFEST_VERSION = 1
 
 
 def parse_args() -> argparse.Namespace:
@@ -32,17 +49,55 @@ def parse_args() -> argparse.Namespace:
         default=2200,
         help='Downscale images larger than this many pixels on the longest edge. Default: 2200',
     )
+    parser.add_argument(
+        '--widths',
+        default=DEFAULT_WIDTHS,
+        help=(
+            'Comma-separated widths for responsive srcset variants, written as '
+            f'<name>.w<width>.webp. Empty disables variants. Default: {DEFAULT_WIDTHS}'
+        ),
+    )
+    parser.add_argument(
+        '--static-root',
+        default='static',
+        help='Static folder the variants manifest paths are relative to. Default: static',
+    )
+    parser.add_argument(
+        '--jobs',
+        type=int,
+        default=os.cpu_count() or 1,
+        help='Worker processes encoding in parallel. Default: number of CPUs',
+    )
+    parser.add_argument(
+        '--build-manifest',
+        default='image-build-manifest.json',
+        help=(
+            'Records each source\'s content hash, encoder settings and outputs; '
+            'only sources whose entry no longer matches are rebuilt. '
+            'Default: image-build-manifest.json'
+        ),
+    )
     parser.add_argument(
         '--force',
         action='store_true',
-        help='Rebuild WebP files even when they are newer than the source image.',
+        help='Rebuild every image regardless of the build manifest.',
+    )
+    parser.add_argument(
+        '--adopt-existing',
+        action='store_true',
+        help=(
+            'Record sources whose outputs already exist as up to date without '
+            're-encoding them (for trees converted before the build manifest existed).'
+        ),
     )
     parser.add_argument(
         '--keep-larger',
         action='store_true',
         help='Keep a generated WebP even when it is larger than the source image.',
     )
-    return parser.parse_args()
+    args = parser.parse_args()
+    args.widths = sorted({int(w) for w in args.widths.split(',') if w.strip()})
+    return args
 
 
 def iter_source_images(root: Path):
@@ -54,30 +109,133 @@ def iter_source_images(root: Path):
         yield path
 
 
-def convert_image(source: Path, quality: int, max_dimension: int) -> Path:
-    destination = source.with_suffix('.webp')
-    destination.parent.mkdir(parents=True, exist_ok=True)
+def encoder_settings(args: argparse.Namespace) -> dict:
+    return {
+        'quality': args.quality,
+        'method': WEBP_METHOD,
+        'max_dimension': args.max_dimension,
+        'widths': args.widths,
+        'keep_larger': args.keep_larger,
+    }
+
+
+def convert_image(source: str, settings: dict) -> dict:
+    """Encode one source's full-size WebP and width variants; runs in a worker process.
+
+    The source is decoded once. Returns the outputs written and timing so the
+    parent can print progress and update the build manifest.
+    """
+    started = time.perf_counter()
+    source_path = Path(source)
+    quality = settings['quality']
+    img = load_image(source_path, settings['max_dimension'])
+    source_size = source_path.stat().st_size
+
+    destination = source_path.with_suffix('.webp')
+    temp_path = Path(save_webp(img, destination, quality))
+    webp_size = temp_path.stat().st_size
+    if webp_size >= source_size and not settings['keep_larger']:
+        temp_path.unlink(missing_ok=True)
+        webp = None
+    else:
+        temp_path.replace(destination)
+        webp = str(destination)
+
+    variants = {}
+    for width in variant_widths(img.width, settings['widths']):
+        resized = resize_to_width(img, width)
+        variant = Path(variant_path(source, width))
+        Path(save_webp(resized, variant, quality)).replace(variant)
+        variants[str(width)] = str(variant)
+
+    outputs = [path for path in [webp, *variants.values()] if path]
+    return {
+        'source': source,
+        'source_size': source_size,
+        'webp': webp,
+        'variants': variants,
+        'output_bytes': sum(os.path.getsize(path) for path in outputs),
+        'seconds': time.perf_counter() - started,
+    }
 
-    fd, temp_name = tempfile.mkstemp(suffix='.webp', dir=str(destination.parent))
-    os.close(fd)
-    temp_path = Path(temp_name)
 
+def output_width(source: Path, max_dimension: int) -> int:
+    """Width load_image() would produce, read from the header without decoding."""
     with Image.open(source) as img:
-        img = ImageOps.exif_transpose(img)
-        if max(img.size) > max_dimension:
-            img.thumbnail((max_dimension, max_dimension), Image.Resampling.LANCZOS)
+        width, height = img.size
+        if img.getexif().get(0x0112) in (5, 6, 7, 8):
+            width, height = height, width
+    if max(width, height) > max_dimension:
+        width = round(width * max_dimension / max(width, height))
+    return width
 
-        if img.mode not in ('RGB', 'RGBA'):
-            img = img.convert('RGBA' if 'A' in img.getbands() else 'RGB')
 
-        save_kwargs = {
-            'format': 'WEBP',
-            'quality': quality,
-            'method': 6,
-        }
-        img.save(temp_path, **save_kwargs)
+def variant_widths(full_width: int, widths: list[int]) -> list[int]:
+    # Never upscale: the full-size image already covers its own width.
+    return [w for w in widths if w < full_width]
 
-    return temp_path
+
+def served_width(source: Path) -> int:
+    # The site serves the WebP when it exists, else the original file.
+    webp = source.with_suffix('.webp')
+    if webp.exists():
+        with Image.open(webp) as img:
+            return img.width
+    return output_width(source, max_dimension=1 << 30)
+
+
+def write_variants_manifest(static_root: Path, sources: list[Path], widths: list[int]) -> Path:
+    images = {}
+    for source in sources:
+        full_width = served_width(source)
+        variants = {}
+        for width in variant_widths(full_width, widths):
+            path = Path(variant_path(str(source), width))
+            if path.exists():
+                variants[str(width)] = path.relative_to(static_root).as_posix()
+        if variants:
+            stem = source.with_suffix('').relative_to(static_root).as_posix()
+            images[stem] = {'width': full_width, 'variants': variants}
+
+    destination = static_root / VARIANTS_FILE
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    payload = {'widths': widths, 'images': dict(sorted(images.items()))}
+    destination.write_text(json.dumps(payload, indent=1) + '\n')
+    return destination
+
+
+def load_build_manifest(path: Path) -> dict:
+    try:
+        data = json.loads(path.read_text())
+    except (OSError, ValueError):
+        return {}
+    if data.get('version') != BUILD_MANIFEST_VERSION:
+        return {}
+    return data.get('sources', {})
+
+
+def write_build_manifest(path: Path, entries: dict) -> None:
+    payload = {'version': BUILD_MANIFEST_VERSION, 'sources': dict(sorted(entries.items()))}
+    temp_path = path.with_name(path.name + '.tmp')
+    temp_path.write_text(json.dumps(payload, indent=1) + '\n')
+    temp_path.replace(path)
+
+
+def outputs_present(entry: dict) -> bool:
+    paths = [entry.get('webp'), *entry.get('variants', {}).values()]
+    return all(Path(path).exists() for path in paths if path)
+
+
+def existing_outputs(source: Path, settings: dict) -> dict | None:
+    """Outputs an earlier run left for ``source``, or None if any are missing."""
+    webp = source.with_suffix('.webp')
+    variants = {}
+    for width in variant_widths(output_width(source, settings['max_dimension']), settings['widths']):
+        variant = Path(variant_path(str(source), width))
+        if not variant.exists():
+            return None
+        variants[str(width)] = str(variant)
+    return {'webp': str(webp) if webp.exists() else None, 'variants': variants}
 
 
 def main() -> int:
@@ -87,38 +245,92 @@ def main() -> int:
         print(f'Root folder not found: {root}')
         return 1
 
-    converted = 0
-    skipped = 0
-    saved_bytes = 0
+    settings = encoder_settings(args)
+    manifest_path = Path(args.build_manifest)
+    previous = load_build_manifest(manifest_path)
+    entries = {}
+    pending = []
+    adopted = 0
 
-    for source in iter_source_images(root):
-        destination = source.with_suffix('.webp')
+    sources = sorted(iter_source_images(root))
+    for source in sources:
+        key = str(source)
+        digest = content_hash(source)
+        entry = previous.get(key)
         if (
-            destination.exists()
-            and not args.force
-            and destination.stat().st_mtime >= source.stat().st_mtime
+            not args.force
+            and entry is not None
+            and entry.get('hash') == digest
+            and entry.get('settings') == settings
+            and outputs_present(entry)
         ):
-            skipped += 1
+            entries[key] = entry
             continue
+        if args.adopt_existing and not args.force:
+            outputs = existing_outputs(source, settings)
+            if outputs is not None:
+                entries[key] = {'hash': digest, 'settings': settings, **outputs}
+                adopted += 1
+                continue
+        pending.append((key, digest))
 
-        temp_path = convert_image(source, args.quality, args.max_dimension)
-        source_size = source.stat().st_size
-        webp_size = temp_path.stat().st_size
+    converted = 0
+    skipped = len(sources) - len(pending)
+    saved_bytes = 0
+    source_bytes = 0
+    output_count = 0
+    encode_seconds = 0.0
+    started = time.perf_counter()
 
-        if webp_size >= source_size and not args.keep_larger:
-            temp_path.unlink(missing_ok=True)
-            skipped += 1
-            continue
+    # Largest first, so one big photo does not start last and stretch the tail.
+    pending.sort(key=lambda item: os.path.getsize(item[0]), reverse=True)
+    jobs = max(1, min(args.jobs, len(pending) or 1))
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = {pool.submit(convert_image, key, settings): (key, digest) for key, digest in pending}
+        for future in as_completed(futures):
+            key, digest = futures[future]
+            result = future.result()
 
-        temp_path.replace(destination)
-        converted += 1
-        saved_bytes += source_size - destination.stat().st_size
-        print(f'{source} -> {destination} ({source_size} -> {destination.stat().st_size} bytes)')
+            # Drop outputs an older run made that the new settings no longer produce.
+            stale = previous.get(key, {})
+            for path in [stale.get('webp'), *stale.get('variants', {}).values()]:
+                if path and path != result['webp'] and path not in result['variants'].values():
+                    Path(path).unlink(missing_ok=True)
+
+            entries[key] = {
+                'hash': digest,
+                'settings': settings,
+                'webp': result['webp'],
+                'variants': result['variants'],
+            }
+            converted += 1
+            source_bytes += result['source_size']
+            encode_seconds += result['seconds']
+            output_count += len(result['variants']) + (1 if result['webp'] else 0)
+            if result['webp']:
+                saved_bytes += result['source_size'] - os.path.getsize(result['webp'])
+            print(
+                f"{key}: {result['seconds']:.2f}s, {result['source_size']} -> "
+                f"{result['output_bytes']} bytes in {len(result['variants']) + (1 if result['webp'] else 0)} files"
+            )
+
+    elapsed = time.perf_counter() - started
+    write_build_manifest(manifest_path, entries)
+
+    if args.widths:
+        manifest = write_variants_manifest(Path(args.static_root), sources, args.widths)
+        print(f'Variants manifest: {manifest}')
 
     print(
-        f'Converted: {converted} | Skipped: {skipped} | '
-        f'Net bytes saved: {saved_bytes}'
+        f'Converted: {converted} | Skipped: {skipped} (adopted {adopted}) | '
+        f'Outputs: {output_count} | Net bytes saved: {saved_bytes}'
     )
+    if converted:
+        print(
+            f'Wall {elapsed:.2f}s with {jobs} jobs | encode CPU {encode_seconds:.2f}s | '
+            f'{converted / elapsed:.2f} images/s | {source_bytes / elapsed / 1e6:.2f} MB/s of source | '
+            f'parallel speedup {encode_seconds / elapsed:.1f}x'
+        )
     return 0
 
 
@@ -0,0 +1,132 @@
+from __future__ import annotations
+
+import argparse
+import gzip
+import os
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from static_assets import IGNORED_DIRS, IGNORED_NAMES, PRECOMPRESSED_ENCODINGS  # noqa: E402
+
+
+COMPRESSIBLE_EXTENSIONS = {
+    '.css', '.js', '.mjs', '.json', '.map', '.svg', '.html', '.txt', '.md', '.xml', '.wasm', '.ico',
+}
+
+
+def gzip_encoder():
+    return lambda data: gzip.compress(data, compresslevel=9, mtime=0)
+
+
+def brotli_encoder():
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return lambda data: brotli.compress(data, quality=11)
+
+
+def zstd_encoder():
+    try:
+        import zstandard
+    except ImportError:
+        return None
+    compressor = zstandard.ZstdCompressor(level=19)
+    return compressor.compress
+
+
+ENCODER_FACTORIES = {'gzip': gzip_encoder, 'br': brotli_encoder, 'zstd': zstd_encoder}
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description=(
+            'Write .gz (and .br/.zst when brotli/zstandard are installed) siblings for '
+            'text assets so the static route can serve them without compressing per request.'
+        )
+    )
+    parser.add_argument(
+        '--root',
+        default='static',
+        help='Static folder to scan. Default: static',
+    )
+    parser.add_argument(
+        '--min-size',
+        type=int,
+        default=512,
+        help='Skip files smaller than this many bytes. Default: 512',
+    )
+    parser.add_argument(
+        '--force',
+        action='store_true',
+        help='Recompress even when a sibling is already in sync with its source.',
+    )
+    return parser.parse_args()
+
+
+def iter_assets(root: Path):
+    for path in sorted(root.rglob('*')):
+        if not path.is_file() or path.suffix.lower() not in COMPRESSIBLE_EXTENSIONS:
+            continue
+        if path.name in IGNORED_NAMES or any(part in IGNORED_DIRS or part.startswith('.') for part in path.parts):
+            continue
+        yield path
+
+
+def main() -> int:
+    args = parse_args()
+    root = Path(args.root)
+    if not root.exists():
+        print(f'Root folder not found: {root}')
+        return 1
+
+    encoders = []
+    for encoding, suffix in PRECOMPRESSED_ENCODINGS:
+        encoder = ENCODER_FACTORIES[encoding]()
+        if encoder is None:
+            print(f'{encoding}: encoder not installed, skipping')
+            continue
+        encoders.append((encoding, suffix, encoder))
+
+    totals = {encoding: [0, 0, 0] for encoding, _suffix, _encoder in encoders}  # files, in, out
+    written = 0
+    up_to_date = 0
+
+    for source in iter_assets(root):
+        stat = source.stat()
+        if stat.st_size < args.min_size:
+            continue
+        data = None
+        for encoding, suffix, encoder in encoders:
+            sibling = source.with_name(source.name + suffix)
+            # Siblings carry their source's mtime, which is also how the app
+            # tells a fresh sibling from a stale one.
+            if not args.force and sibling.exists() and sibling.stat().st_mtime_ns == stat.st_mtime_ns:
+                up_to_date += 1
+                continue
+            if data is None:
+                data = source.read_bytes()
+            compressed = encoder(data)
+            if len(compressed) >= len(data) * 0.95:
+                sibling.unlink(missing_ok=True)
+                continue
+            temp_path = sibling.with_name(sibling.name + '.tmp')
+            temp_path.write_bytes(compressed)
+            os.utime(temp_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+            temp_path.replace(sibling)
+            written += 1
+            totals[encoding][0] += 1
+            totals[encoding][1] += len(data)
+            totals[encoding][2] += len(compressed)
+
+    for encoding, (count, before, after) in totals.items():
+        if count:
+            print(f'{encoding}: {count} files, {before} -> {after} bytes ({after / before:.1%})')
+    print(f'Written: {written} | Up to date: {up_to_date}')
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -9,6 +9,9 @@
     let autoChangeTimer = null;
     let paused = false;
     const AUTO_CHANGE_INTERVAL = 45000; // 45 seconds
+    // Fingerprinted URL from base.html, so the browser can cache it long-term
+    const script = document.currentScript;
+    const LYRICS_URL = (script && script.dataset.lyricsUrl) || '/static/data/lyrics.json';
 
     /**
      * Fisher-Yates shuffle algorithm
@@ -28,7 +31,7 @@
     async function fetchLyrics() {
         if (!document.getElementById('footer-lyrics')) return;
         try {
-            const response = await fetch('/static/data/lyrics.json');
+            const response = await fetch(LYRICS_URL);
             if (!response.ok) throw new Error('Failed to fetch lyrics');
             const data = await response.json();
             lyricsData = shuffleArray(data);
@@ -28,7 +28,7 @@
           .then(function (r) { return r.ok ? r.json() : null; })
           .then(function (d) {
             if (!d) return;
-            if (d.counted !== false) sessionStorage.setItem('hunterVisited', '1');
+            if (d.counted !== false || d.duplicate) sessionStorage.setItem('hunterVisited', '1');
             display(d.count);
           })
           .catch(function () {});
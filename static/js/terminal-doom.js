@@ -15,7 +15,9 @@
  * Exposes window.TerminalDoom.start(outputEl, onExit).
  */
 (function () {
-  var EMBED_URL = '/static/vendor/doom-clone/doom.html';
+  // base.html passes the fingerprinted URL; the fallback is unversioned.
+  var script = document.currentScript;
+  var EMBED_URL = (script && script.dataset.embedUrl) || '/static/vendor/doom-clone/doom.html';
 
   function start(outputEl, onExit) {
     if (document.getElementById('term-doom-frame')) return;
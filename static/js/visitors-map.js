@@ -37,49 +37,78 @@
     });
   }
 
-  fetch('/api/visitor-locations')
-    .then(function (r) { return r.json(); })
-    .then(function (data) {
-      var loading = document.getElementById('map-loading');
-      if (loading) loading.style.display = 'none';
+  function showStats(data) {
+    var totalVisits = data.total_visits || 0;
+    var formatted = totalVisits.toLocaleString();
+    var sv = document.getElementById('stat-visits');
+    var sl = document.getElementById('stat-locations');
+    var sc = document.getElementById('stat-countries');
+    if (sv) sv.textContent = formatted;
+    if (sl) sl.textContent = (data.location_count || 0).toLocaleString();
+    if (sc) sc.textContent = data.unique_countries || 0;
 
-      var totalVisits = data.total_visits || 0;
-      var formatted = totalVisits.toLocaleString();
-      var sv = document.getElementById('stat-visits');
-      var sl = document.getElementById('stat-locations');
-      var sc = document.getElementById('stat-countries');
-      if (sv) sv.textContent = formatted;
-      if (sl) sl.textContent = (data.locations || []).length.toLocaleString();
-      if (sc) sc.textContent = data.unique_countries || 0;
+    var footerCounter = document.querySelector('.visit-counter');
+    if (footerCounter) {
+      footerCounter.innerHTML = '<i class="fas fa-eye"></i> ' + formatted + ' visits';
+    }
+  }
 
-      var footerCounter = document.querySelector('.visit-counter');
-      if (footerCounter) {
-        footerCounter.innerHTML = '<i class="fas fa-eye"></i> ' + formatted + ' visits';
-      }
+  function drawPoints(points) {
+    markerLayer.clearLayers();
+    var bounds = [];
+    points.forEach(function (g) {
+      var label = g.locations > 1
+        ? g.locations.toLocaleString() + ' locations near ' + ([g.city, g.country].filter(Boolean).join(', ') || 'here')
+        : [g.city, g.country].filter(Boolean).join(', ') || 'Unknown';
+      var visits = g.count === 1 ? '1 visit' : g.count.toLocaleString() + ' visits';
+      var popup = '<div class="map-popup"><i class="fas fa-map-marker-alt"></i> ' + label + '<br><small>' + visits + '</small></div>';
+      var point = [g.lat, g.lon];
+      bounds.push(point);
+      L.marker(point, { icon: pinIcon(g.count) }).bindPopup(popup).addTo(markerLayer);
+    });
+    return bounds;
+  }
 
-      var groups = {};
-      (data.locations || []).forEach(function (loc) {
-        var key = loc.lat + ',' + loc.lon;
-        if (!groups[key]) {
-          groups[key] = { lat: loc.lat, lon: loc.lon, city: loc.city, country: loc.country, count: 0 };
-        }
-        groups[key].count++;
-      });
+  /* Clusters come from the server for the visible box at the current zoom,
+   * so panning only ever fetches and draws what is on screen. */
+  function viewQuery() {
+    var b = map.getBounds();
+    var bbox = [b.getWest(), b.getSouth(), b.getEast(), b.getNorth()]
+      .map(function (v) { return v.toFixed(4); }).join(',');
+    return '&zoom=' + map.getZoom() + '&bbox=' + bbox;
+  }
 
-      var bounds = [];
-      Object.keys(groups).forEach(function (key) {
-        var g = groups[key];
-        var label = [g.city, g.country].filter(Boolean).join(', ') || 'Unknown';
-        var visits = g.count === 1 ? '1 visit' : g.count.toLocaleString() + ' visits';
-        var popup = '<div class="map-popup"><i class="fas fa-map-marker-alt"></i> ' + label + '<br><small>' + visits + '</small></div>';
-        var point = [g.lat, g.lon];
-        bounds.push(point);
-        L.marker(point, { icon: pinIcon(g.count) }).bindPopup(popup).addTo(markerLayer);
-      });
+  var pending = 0;
+  function load(query) {
+    var ticket = ++pending;
+    return fetch('/api/visitor-locations?mode=grouped' + query)
+      .then(function (r) { return r.json(); })
+      .then(function (data) { return ticket === pending ? data : null; });
+  }
+
+  var refreshTimer = null;
+  function scheduleRefresh() {
+    window.clearTimeout(refreshTimer);
+    refreshTimer = window.setTimeout(function () {
+      load(viewQuery())
+        .then(function (data) { if (data) drawPoints(data.points || []); })
+        .catch(function () {});
+    }, 150);
+  }
+
+  load('&zoom=' + map.getZoom())
+    .then(function (data) {
+      var loading = document.getElementById('map-loading');
+      if (loading) loading.style.display = 'none';
+      if (!data) return;
 
+      showStats(data);
+      var bounds = drawPoints(data.points || []);
       if (bounds.length) {
         map.fitBounds(bounds, { padding: [42, 42], maxZoom: 4 });
       }
+      map.on('moveend', scheduleRefresh);
+      scheduleRefresh();
       window.setTimeout(function () { map.invalidateSize(); }, 0);
     })
     .catch(function () {
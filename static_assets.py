@@ -0,0 +1,383 @@
+"""In-memory manifest of the files under ``static/``.
+
+The site resolves image paths on every page render: it prefers a WebP
+sibling when one exists, falls back between two icon locations and lists a
+project's gallery folder. ``StaticAssetManifest`` walks the tree once and
+answers those questions from dictionaries, so the request path makes no
+``stat``/``listdir`` calls.
+
+Each entry also carries a content hash used to fingerprint asset URLs
+(``/static/css/style.css?v=<hash>``). Hashing reads every file, so
+``scripts/build_asset_manifest.py`` does it once at build time and writes the
+manifest to JSON. At startup the app walks the tree again (``stat`` only) and
+reuses the persisted entries whose size and mtime still match, hashing only
+files that changed, so a stale file is never trusted.
+
+Precompressed siblings written by ``scripts/precompress_static.py``
+(``style.css.gz``/``.br``/``.zst``) are indexed per asset rather than as
+assets of their own, so the static route can pick one for the client's
+``Accept-Encoding`` without a filesystem probe.
+
+Vendored bundles (``vendor/<package>/``) can also be addressed under a
+directory-wide fingerprint, ``vendor/<package>~<hash>/...``, so the relative
+URLs inside them are versioned as well.
+
+Responsive variants written by ``scripts/convert_images_to_webp.py``
+(``photo.w640.webp`` next to ``photo.webp``) are listed in
+``data/image-variants.json``; the manifest exposes them per image for
+``srcset`` and keeps them out of project galleries.
+"""
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+
+from PIL import Image, ImageOps
+
+
+# Image extensions to look for
+IMAGE_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.gif', '.svg', '.webp'}
+WEBP_SOURCE_EXTENSIONS = {'.png', '.jpg', '.jpeg'}
+
+# Project galleries live at images/projects/<category>/<project id>/<file>.
+GALLERY_PREFIX = 'images/projects/'
+
+# Runtime files the app may write under static/data when DATA_DIR is left at
+# its default; they are not site assets.
+IGNORED_NAMES = {'visits.json'}
+IGNORED_SUFFIXES = ('.sqlite3', '.sqlite3-wal', '.sqlite3-shm', '.sqlite3-journal', '.bin', '.tmp')
+IGNORED_DIRS = {'archive', 'image-cache'}
+
+# Width-ladder variants: <stem>.w<width>.webp, described by VARIANTS_FILE.
+VARIANT_RE = re.compile(r'\.w(\d+)\.webp$')
+VARIANTS_FILE = 'data/image-variants.json'
+
+# Precompressed siblings, in the order the server prefers them.
+PRECOMPRESSED_ENCODINGS = (('br', '.br'), ('zstd', '.zst'), ('gzip', '.gz'))
+
+MANIFEST_VERSION = 2
+
+# Encoder effort shared by the offline converter and the /img resize route.
+WEBP_METHOD = 6
+HASH_LENGTH = 12
+
+
+def _ignored(name):
+    return name.startswith('.') or name in IGNORED_NAMES or name.endswith(IGNORED_SUFFIXES)
+
+
+def is_runtime_file(path):
+    """True for a file the app writes under ``static/`` at runtime (visitor DB,
+    archives, caches); such files must never be served."""
+    parts = path.lower().split('/')
+    return any(part in IGNORED_DIRS for part in parts[:-1]) or _ignored(parts[-1])
+
+
+def variant_path(path, width):
+    """Where the ``width``-pixel variant of an image lives (same folder)."""
+    return f'{os.path.splitext(path)[0]}.w{width}.webp'
+
+
+def load_image(source, max_dimension):
+    """Decode an image upright (EXIF orientation applied) and at most ``max_dimension`` px."""
+    with Image.open(source) as img:
+        img = ImageOps.exif_transpose(img)
+        if max(img.size) > max_dimension:
+            img.thumbnail((max_dimension, max_dimension), Image.Resampling.LANCZOS)
+
+        if img.mode not in ('RGB', 'RGBA'):
+            img = img.convert('RGBA' if 'A' in img.getbands() else 'RGB')
+        img.load()
+    return img
+
+
+def resize_to_width(img, width):
+    return img.resize((width, max(1, round(img.height * width / img.width))), Image.Resampling.LANCZOS)
+
+
+def save_webp(img, destination, quality):
+    """Encode ``img`` to a temp file beside ``destination``; the caller renames it into place."""
+    destination = str(destination)
+    os.makedirs(os.path.dirname(destination) or '.', exist_ok=True)
+
+    # A .tmp name keeps half-written files out of the asset manifest and the
+    # resize cache's accounting.
+    fd, temp_name = tempfile.mkstemp(suffix='.webp.tmp', dir=os.path.dirname(destination) or '.')
+    os.close(fd)
+
+    save_kwargs = {
+        'format': 'WEBP',
+        'quality': quality,
+        'method': WEBP_METHOD,
+    }
+    img.save(temp_name, **save_kwargs)
+    return temp_name
+
+
+def content_hash(path):
+    """Short hex digest of a file's bytes, stable across builds and hosts."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:HASH_LENGTH]
+
+
+class StaticAssetManifest:
+    """Path -> metadata index for ``root`` with WebP and gallery lookups.
+
+    All lookups take paths relative to ``root`` with forward slashes. With
+    ``refresh_seconds`` > 0 the tree is re-walked at most that often, on the
+    next lookup after the interval, so local edits show up without a restart.
+    """
+
+    def __init__(self, root, manifest_path=None, refresh_seconds=0.0):
+        self.root = root
+        self.manifest_path = manifest_path
+        self.refresh_seconds = refresh_seconds
+        self._lock = threading.Lock()
+        self._state = {'files': {}, 'webp': {}, 'galleries': {}, 'variants': {}, 'encoded': {}, 'trees': {}}
+        self._checked_at = 0.0
+        self._version = None
+        self._stats = {'builds': 0, 'files': 0, 'reused_entries': 0, 'hashed_files': 0}
+
+    def _walk(self):
+        files = {}
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            dirnames[:] = sorted(d for d in dirnames if not d.startswith('.') and d not in IGNORED_DIRS)
+            for name in filenames:
+                if _ignored(name):
+                    continue
+                abspath = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(abspath)
+                except OSError:
+                    continue
+                rel = os.path.relpath(abspath, self.root).replace(os.sep, '/')
+                files[rel] = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+        return files
+
+    def _read_persisted(self):
+        if not self.manifest_path:
+            return {}
+        try:
+            with open(self.manifest_path, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if data.get('version') != MANIFEST_VERSION:
+            return {}
+        return data.get('files', {})
+
+    @staticmethod
+    def _webp_candidate(path):
+        stem, ext = os.path.splitext(path)
+        return f'{stem}.webp' if ext.lower() in WEBP_SOURCE_EXTENSIONS else None
+
+    @classmethod
+    def _index(cls, files):
+        webp = {}
+        galleries = {}
+        for rel in files:
+            candidate = cls._webp_candidate(rel)
+            if candidate in files:
+                webp[rel] = candidate
+            if VARIANT_RE.search(rel):
+                continue
+            if rel.startswith(GALLERY_PREFIX) and os.path.splitext(rel)[1].lower() in IMAGE_EXTENSIONS:
+                parts = rel[len(GALLERY_PREFIX):].split('/')
+                if len(parts) == 3:
+                    galleries.setdefault((parts[0], parts[1]), []).append(rel)
+        for paths in galleries.values():
+            paths.sort()
+        return webp, {key: tuple(paths) for key, paths in galleries.items()}
+
+    def _read_variants(self, files):
+        """Image stem -> (full width, ((width, path), ...)) for variants on disk."""
+        try:
+            with open(os.path.join(self.root, *VARIANTS_FILE.split('/')), 'r') as f:
+                images = json.load(f).get('images', {})
+        except (OSError, ValueError):
+            return {}
+        variants = {}
+        for stem, entry in images.items():
+            ladder = tuple(sorted(
+                (int(width), rel) for width, rel in entry.get('variants', {}).items() if rel in files
+            ))
+            if ladder and entry.get('width'):
+                variants[stem] = (int(entry['width']), ladder)
+        return variants
+
+    @staticmethod
+    def _split_encoded(files):
+        """Move precompressed siblings out of ``files`` into asset -> {encoding: path}.
+
+        The compressor stamps each sibling with its source's mtime; a sibling
+        whose mtime no longer matches is stale and is left unused.
+        """
+        encoded = {}
+        for rel in list(files):
+            for encoding, suffix in PRECOMPRESSED_ENCODINGS:
+                base = rel[:-len(suffix)]
+                if rel.endswith(suffix) and base in files:
+                    entry = files.pop(rel)
+                    if entry['mtime_ns'] == files[base]['mtime_ns']:
+                        encoded.setdefault(base, {})[encoding] = rel
+                    break
+        return encoded
+
+    def load(self):
+        """(Re)build the index from disk, hashing only files that changed.
+
+        Entries from the persisted manifest and from the previous in-memory
+        index are reused when their size and mtime still match.
+        """
+        files = self._walk()
+        encoded = self._split_encoded(files)
+        known = self._read_persisted()
+        known.update(self._state['files'])
+        reused = hashed = 0
+        for rel, current in files.items():
+            entry = known.get(rel)
+            if (
+                entry is not None
+                and entry.get('hash')
+                and current['size'] == entry.get('size')
+                and current['mtime_ns'] == entry.get('mtime_ns')
+            ):
+                current['hash'] = entry['hash']
+                reused += 1
+                continue
+            try:
+                current['hash'] = content_hash(os.path.join(self.root, *rel.split('/')))
+            except OSError:
+                current['hash'] = None
+            hashed += 1
+        webp, galleries = self._index(files)
+        self._state = {
+            'files': files,
+            'webp': webp,
+            'galleries': galleries,
+            'variants': self._read_variants(files),
+            'encoded': encoded,
+            'trees': {},
+        }
+        # Changes only when something a page could render differs.
+        self._version = hashlib.sha256(json.dumps(
+            [sorted((rel, entry['hash']) for rel, entry in files.items()), sorted(encoded)],
+        ).encode('utf-8')).hexdigest()[:HASH_LENGTH]
+        self._checked_at = time.monotonic()
+        self._stats['builds'] += 1
+        self._stats['files'] = len(files)
+        self._stats['reused_entries'] = reused
+        self._stats['hashed_files'] = hashed
+        return self
+
+    def write(self, path=None):
+        """Persist the current index as JSON (atomically)."""
+        path = path or self.manifest_path
+        files, webp = self._state['files'], self._state['webp']
+        payload = {
+            'version': MANIFEST_VERSION,
+            'root': self.root,
+            'files': {
+                rel: dict(entry, webp=webp[rel]) if rel in webp else entry
+                for rel, entry in sorted(files.items())
+            },
+        }
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(payload, f, indent=1, sort_keys=True)
+            f.write('\n')
+        os.replace(tmp_path, path)
+        return path
+
+    def _current(self):
+        if self.refresh_seconds > 0 and time.monotonic() - self._checked_at >= self.refresh_seconds:
+            # One thread re-walks; the others keep answering from the old index.
+            if self._lock.acquire(blocking=False):
+                try:
+                    if time.monotonic() - self._checked_at >= self.refresh_seconds:
+                        self.load()
+                finally:
+                    self._lock.release()
+        return self._state
+
+    @property
+    def version(self):
+        """Digest of the indexed content; changes when any asset or sibling does."""
+        self._current()
+        return self._version
+
+    def paths(self):
+        """Every indexed asset path (precompressed siblings excluded)."""
+        return list(self._current()['files'])
+
+    def exists(self, path):
+        return path in self._current()['files']
+
+    def entry(self, path):
+        return self._current()['files'].get(path)
+
+    def content_hash(self, path):
+        """Fingerprint of an asset's current bytes, or None if it is unknown."""
+        entry = self.entry(path)
+        return entry['hash'] if entry else None
+
+    def tree_hash(self, directory):
+        """Fingerprint of every file under ``directory``, or None if it has none.
+
+        For vendored bundles whose pages load siblings by relative URL: a
+        directory-wide version covers files a per-file ``?v=`` cannot reach.
+        """
+        state = self._current()
+        trees = state['trees']
+        if directory not in trees:
+            prefix = directory.rstrip('/') + '/'
+            entries = sorted(
+                (rel, entry['hash']) for rel, entry in state['files'].items() if rel.startswith(prefix)
+            )
+            trees[directory] = hashlib.sha256(
+                json.dumps(entries).encode('utf-8')
+            ).hexdigest()[:HASH_LENGTH] if entries else None
+        return trees[directory]
+
+    def size(self, path):
+        entry = self.entry(path)
+        return entry['size'] if entry else None
+
+    def webp_sibling(self, path):
+        """WebP version of a PNG/JPEG path, or None when there is none.
+
+        Templates may reference only the converted file (the original PNG or
+        JPEG need not be shipped), so the source itself does not have to exist.
+        """
+        state = self._current()
+        sibling = state['webp'].get(path)
+        if sibling is None:
+            candidate = self._webp_candidate(path)
+            if candidate in state['files']:
+                sibling = candidate
+        return sibling
+
+    def gallery(self, category, project_id):
+        """Sorted image paths directly inside a project's image folder."""
+        return self._current()['galleries'].get((category, project_id), ())
+
+    def variants(self, path):
+        """``(full width, ((width, path), ...))`` for an image, or None.
+
+        Looked up by stem, so the source PNG/JPEG path and its WebP resolve
+        to the same ladder.
+        """
+        return self._current()['variants'].get(os.path.splitext(path)[0])
+
+    def encodings(self, path):
+        """``{content-coding: sibling path}`` of fresh precompressed copies of ``path``."""
+        return self._current()['encoded'].get(path)
+
+    def stats(self):
+        return dict(self._stats, refresh_seconds=self.refresh_seconds, version=self._version)